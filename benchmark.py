@@ -0,0 +1,390 @@
+"""
+Benchmark do pipeline de geração (carga do CSV, filtro/agrupamento, substituição, gravação do DOCX
+e lista de presença em PDF) com dados sintéticos.
+
+Uso:
+    python benchmark.py --escolas 20 --turmas 10 --alunos 30 --saida resultado.json
+    python benchmark.py --comparar antes.json depois.json
+    python benchmark.py --apenas-partida --orcamento-partida 0.3
+    python benchmark.py --apenas-partida --sem-interface   # servidor/CI sem display
+
+O resultado é um JSON com vazão, latência p50/p95 por documento e pico de memória (RSS) por etapa,
+para comparar entre commits, e com o tempo de partida a frio da linha de comando e da interface,
+conferido contra um orçamento (o código de saída é 1 se ele for estourado).
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import threading
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+import pandas as pd
+from docx import Document
+from docx.shared import Pt
+from docx.oxml import parse_xml
+
+import main
+
+# Caixa de texto (VML) com placeholder quebrado em dois runs, como o Word costuma gravar
+CAIXA_TEXTO = (
+    '<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:v="urn:schemas-microsoft-com:vml"><w:pict><v:shape style="width:220pt;height:40pt">'
+    '<v:textbox><w:txbxContent><w:p><w:r><w:rPr><w:b/></w:rPr><w:t>Aluno: $VARIÁVEL NOME</w:t></w:r>'
+    '<w:r><w:t xml:space="preserve"> DO ALUNO</w:t></w:r></w:p></w:txbxContent></v:textbox>'
+    '</v:shape></w:pict></w:r>'
+)
+
+NOMES = ["ANA", "BRUNO", "CARLA", "DIEGO", "ELISA", "FABIO", "GABRIELA", "HEITOR", "IARA", "JOAO",
+         "KAREN", "LUCAS", "MARIA", "NICOLAS", "OLIVIA", "PEDRO", "RAFAELA", "SAMUEL", "TALITA", "VITOR"]
+SOBRENOMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "LIMA", "PEREIRA", "COSTA", "RODRIGUES",
+              "ALMEIDA", "NASCIMENTO", "ARAUJO", "MELO", "BARBOSA", "CARDOSO", "D'AVILA"]
+
+def gerar_csv_sintetico(caminho, escolas, turmas, alunos, formato="aluno_format", semente=0):
+    """Gera um CSV no formato de alunos ou de funcionários com escolas × turmas × alunos linhas"""
+    aleatorio = random.Random(semente)
+    colunas = main.COLUNAS_POR_FORMATO[formato]
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write(";".join(colunas) + "\n")
+        for e in range(escolas):
+            escola = f"ESCOLA MUNICIPAL {e:04d}"
+            for t in range(turmas):
+                etapa = f"{t % 9 + 1}º ANO"
+                turma = f"{etapa} {chr(65 + t // 9)}"
+                for a in range(alunos):
+                    nome = (f"{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)} "
+                            f"{aleatorio.choice(SOBRENOMES)} {e}{t}{a}")
+                    if formato == "aluno_format":
+                        linha = [escola, turma, nome, f"PROF {e}-{t}", etapa]
+                    else:
+                        linha = [escola, nome, f"{aleatorio.randrange(10 ** 11):011d}", etapa, turma,
+                                 aleatorio.choice(["MANHA", "TARDE"])]
+                    f.write(";".join(linha) + "\n")
+
+def gerar_modelo_sintetico(caminho, paragrafos=40):
+    """Gera um modelo Word com placeholders no corpo, numa tabela e numa caixa de texto"""
+    doc = Document()
+    p = doc.add_paragraph()
+    r = p.add_run("Escola: $VARIÁVEL ES")
+    r.bold = True
+    r.font.size = Pt(14)
+    p.add_run("COLA - Turma: $VARIÁVEL TURMA")
+    doc.add_paragraph("Professor(a) regente: $VARIÁVEL PROFESSOR REGENTE")
+    p = doc.add_paragraph("Identificação: ")
+    p._p.append(parse_xml(CAIXA_TEXTO))
+
+    tabela = doc.add_table(rows=2, cols=2)
+    tabela.cell(0, 0).text = "Aluno 1"
+    tabela.cell(0, 1).text = "Aluno 2"
+    tabela.cell(1, 0).text = "$VARIÁVEL NOME DO ALUNO"
+    tabela.cell(1, 1).text = "$VARIÁVEL NOME DO ALUNO 2"
+
+    # Texto fixo (instruções, questões) para o documento ter um tamanho realista
+    for i in range(paragrafos):
+        doc.add_paragraph(f"{i + 1}. Marque apenas uma alternativa por questão, preenchendo toda a bolha. "
+                          "Use caneta azul ou preta e não rasure o gabarito.")
+    doc.save(caminho)
+
+class AmostradorMemoria:
+    """
+    Maior memória residente (main.memoria_residente_mb) vista enquanto está ativo, amostrada por
+    uma thread a cada `intervalo` segundos: pega também os picos passageiros dentro de uma chamada.
+    O pico fica None se a memória não puder ser medida (sem /proc nem psutil).
+    """
+    def __init__(self, intervalo=0.01):
+        self.intervalo = intervalo
+        self.pico = None
+        self._parar = threading.Event()
+        self._thread = None
+
+    def amostrar(self):
+        atual = main.memoria_residente_mb()
+        if atual is not None and (self.pico is None or atual > self.pico):
+            self.pico = atual
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self.amostrar()
+
+    def iniciar(self):
+        self.amostrar()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, daemon=True)
+            self._thread.start()
+
+    def parar(self):
+        if self._thread is not None:
+            self._parar.set()
+            self._thread.join()
+            self._thread = None
+        self.amostrar()
+        return round(self.pico, 1) if self.pico is not None else None
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    posicao = (len(ordenados) - 1) * p / 100
+    baixo = int(posicao)
+    alto = min(baixo + 1, len(ordenados) - 1)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (posicao - baixo)
+
+class Medicao:
+    """Latências de uma etapa; `unidade` diz o que é contado na vazão (documentos, linhas...)"""
+    def __init__(self, unidade="documentos"):
+        self.unidade = unidade
+        self.latencias = []
+        self.itens = 0
+        self.memoria = AmostradorMemoria()  # Pico de RSS só desta etapa
+
+    def medir(self, funcao, *args, itens=1):
+        self.memoria.iniciar()
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        self.latencias.append(time.perf_counter() - inicio)
+        self.memoria.amostrar()
+        self.itens += itens
+        return resultado
+
+    def resumo(self):
+        total = sum(self.latencias)
+        return {
+            "unidade": self.unidade,
+            "itens": self.itens,
+            "total_s": round(total, 4),
+            "vazao_por_s": round(self.itens / total, 1) if total else None,
+            "p50_ms": round(percentil(self.latencias, 50) * 1000, 3),
+            "p95_ms": round(percentil(self.latencias, 95) * 1000, 3),
+            "pico_rss_mb": self.memoria.parar(),
+        }
+
+# Bibliotecas que não devem ser carregadas só por importar o main (ModuloSobDemanda)
+MODULOS_PESADOS = ("pandas", "numpy", "lxml.etree", "reportlab.pdfgen.canvas", "docx", "tkinter")
+
+# Executados em processos novos; o tempo medido começa com o interpretador já aberto
+PARTIDA_IMPORTACAO = (
+    "import sys, time\n"
+    "inicio = time.perf_counter()\n"
+    "import main\n"
+    "print(time.perf_counter() - inicio)\n"
+    "print(','.join(m for m in {modulos!r} if m in sys.modules))\n"
+)
+PARTIDA_INTERFACE = (
+    "import time\n"
+    "inicio = time.perf_counter()\n"
+    "import main\n"
+    "root = main.tk.Tk()\n"
+    "main.App(root)\n"
+    "root.update()\n"
+    "print(time.perf_counter() - inicio)\n"
+    "root.destroy()\n"
+)
+
+def _tempos_de_partida(codigo, repeticoes):
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    tempos, saida = [], ""
+    for _ in range(repeticoes):
+        resultado = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, cwd=pasta)
+        if resultado.returncode != 0:
+            return None, resultado.stderr.strip().splitlines()[-1:]  # Ex.: interface sem display
+        linhas = resultado.stdout.splitlines()
+        tempos.append(float(linhas[0]))
+        saida = linhas[1:]
+    return tempos, saida
+
+def medir_partida(repeticoes, orcamento, medir_interface=True):
+    """
+    Tempo de partida a frio (mediana de processos novos): só importar o main, que é o custo de
+    qualquer execução em lote, e abrir a janela da interface até o primeiro desenho.
+    Uma medida que falhou (ex.: interface sem display) estoura o orçamento; com
+    medir_interface=False a janela não é medida e fica marcada como não conferida.
+    """
+    tempos, carregados = _tempos_de_partida(PARTIDA_IMPORTACAO.format(modulos=MODULOS_PESADOS), repeticoes)
+    resultado = {
+        "importacao_s": round(percentil(tempos, 50), 4) if tempos else None,
+        "modulos_pesados_carregados": [m for m in (carregados[0] if carregados else "").split(",") if m],
+    }
+    medidas = [resultado["importacao_s"]]
+    if medir_interface:
+        tempos, erro = _tempos_de_partida(PARTIDA_INTERFACE, repeticoes)
+        resultado["interface_s"] = round(percentil(tempos, 50), 4) if tempos else None
+        if tempos is None:
+            resultado["interface_erro"] = " ".join(erro)
+        medidas.append(resultado["interface_s"])
+    else:
+        resultado["interface_s"] = None
+    resultado["interface_conferida"] = resultado["interface_s"] is not None
+    resultado["orcamento_s"] = orcamento
+    resultado["dentro_do_orcamento"] = all(medida is not None and medida <= orcamento for medida in medidas)
+    return resultado
+
+def _ler_tabela(csv_path):
+    _, blocos = main.ler_csv_em_blocos(csv_path)
+    return pd.concat(list(blocos), ignore_index=True)
+
+def _agrupar(df, config):
+    selecionado = df[main._mascara_selecao(df, None, None)]
+    return list(main.montar_unidades(selecionado, config))
+
+def executar_benchmark(escolas, turmas, alunos, amostras, diretorio, partida):
+    """Executa todas as etapas e devolve o dicionário de resultados (`partida` vem de medir_partida)"""
+    csv_alunos = os.path.join(diretorio, "alunos.csv")
+    csv_funcionarios = os.path.join(diretorio, "funcionarios.csv")
+    modelo_path = os.path.join(diretorio, "modelo.docx")
+    saida = os.path.join(diretorio, "saida")
+    os.makedirs(saida, exist_ok=True)
+    gerar_csv_sintetico(csv_alunos, escolas, turmas, alunos, "aluno_format")
+    gerar_csv_sintetico(csv_funcionarios, escolas, turmas, alunos, "professor_format", semente=1)
+    gerar_modelo_sintetico(modelo_path)
+
+    etapas = {}
+    config = main.Configuracao(process_mode="um_aluno")
+    config_funcionarios = main.Configuracao(is_teacher_list=True, apenas_lista_presenca=True)
+
+    # Carga do CSV (os dois formatos) e filtro/agrupamento em unidades (escola, turma)
+    medicao = Medicao("linhas")
+    df = medicao.medir(_ler_tabela, csv_alunos, itens=escolas * turmas * alunos)
+    etapas["carga_csv_alunos"] = medicao.resumo()
+    medicao = Medicao("linhas")
+    df_funcionarios = medicao.medir(_ler_tabela, csv_funcionarios, itens=escolas * turmas * alunos)
+    etapas["carga_csv_funcionarios"] = medicao.resumo()
+
+    medicao = Medicao("linhas")
+    unidades = medicao.medir(_agrupar, df, config, itens=len(df))
+    etapas["filtro_agrupamento_alunos"] = medicao.resumo()
+    medicao = Medicao("linhas")
+    unidades_funcionarios = medicao.medir(_agrupar, df_funcionarios, config_funcionarios, itens=len(df_funcionarios))
+    etapas["filtro_agrupamento_funcionarios"] = medicao.resumo()
+
+    folhas = [dados for unidade in unidades for dados, _ in main.folhas_da_unidade(unidade, config)][:amostras]
+
+    # Substituição pela API pública (documento aberto fora da medição) e pelo modelo compilado
+    medicao = Medicao()
+    for dados in folhas:
+        medicao.medir(main.substituir_variaveis_em_tudo, Document(modelo_path), dados)
+    etapas["substituicao_documento"] = medicao.resumo()
+
+    modelo = main.ModeloCompilado(modelo_path)
+    medicao = Medicao()
+    for dados in folhas:
+        medicao.medir(modelo.preencher, dados)
+    etapas["substituicao_compilada"] = medicao.resumo()
+
+    medicao = Medicao()
+    for i, dados in enumerate(folhas):
+        modelo.preencher(dados)
+        medicao.medir(modelo.salvar, os.path.join(saida, f"gabarito_{i}.docx"))
+    etapas["gravacao_docx"] = medicao.resumo()
+
+    # Listas de presença em PDF (uma por turma e uma de funcionários por escola)
+    medicao = Medicao()
+    for unidade in unidades[:amostras]:
+        medicao.medir(main.criar_lista_presenca, unidade.escola, main.sanitizar_nome(unidade.turma),
+                      unidade.alunos, saida, "Lista de Presença", config.cores, "", False, unidade.turma)
+    etapas["lista_pdf_alunos"] = medicao.resumo()
+    medicao = Medicao()
+    for i, unidade in enumerate(unidades_funcionarios[:amostras]):
+        medicao.medir(main.criar_lista_presenca, unidade.escola, f"funcionarios_{i}",
+                      unidade.funcionarios, saida, "Lista de Presença", config.cores, "", True)
+    etapas["lista_pdf_funcionarios"] = medicao.resumo()
+
+    # Execução completa, como na interface (gabaritos e listas de todas as turmas)
+    medicao = Medicao()
+    relatorio = medicao.medir(main.executar_geracao, csv_alunos, modelo_path, os.path.join(diretorio, "completa"),
+                              config, None, None)
+    medicao.itens = relatorio.gabaritos + relatorio.listas
+    etapas["execucao_completa"] = medicao.resumo()
+
+    return {
+        "commit": _commit_atual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {"escolas": escolas, "turmas": turmas, "alunos": alunos, "amostras": amostras},
+        "partida": partida,
+        "etapas": etapas,
+        "pico_rss_mb": max((etapa["pico_rss_mb"] for etapa in etapas.values()
+                            if etapa["pico_rss_mb"] is not None), default=None),
+    }
+
+def _commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def comparar(antes, depois):
+    """Texto com a variação de vazão e p95 de cada etapa entre dois resultados"""
+    linhas = [f"{'etapa':<34}{'vazão antes':>14}{'vazão depois':>14}{'p95 antes':>12}{'p95 depois':>12}"]
+    for medida in ("importacao_s", "interface_s"):
+        velho, novo = antes.get("partida", {}).get(medida), depois.get("partida", {}).get(medida)
+        if velho is not None and novo is not None:
+            linhas.append(f"{'partida_' + medida[:-2]:<34}{'':>28}{velho * 1000:>10.0f}ms{novo * 1000:>10.0f}ms")
+    for etapa, novo in depois["etapas"].items():
+        velho = antes["etapas"].get(etapa)
+        if velho is None:
+            continue
+        linhas.append(f"{etapa:<34}{velho['vazao_por_s'] or 0:>14}{novo['vazao_por_s'] or 0:>14}"
+                      f"{velho['p95_ms']:>10}ms{novo['p95_ms']:>10}ms")
+    return "\n".join(linhas)
+
+def main_benchmark(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do Gerador de Gabaritos com dados sintéticos")
+    parser.add_argument("--escolas", type=int, default=10)
+    parser.add_argument("--turmas", type=int, default=6)
+    parser.add_argument("--alunos", type=int, default=30)
+    parser.add_argument("--amostras", type=int, default=300,
+                        help="Máximo de documentos medidos nas etapas por documento")
+    parser.add_argument("--saida", help="Arquivo JSON do resultado (padrão: stdout)")
+    parser.add_argument("--diretorio", help="Pasta de trabalho (padrão: temporária, apagada no fim)")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTES", "DEPOIS"),
+                        help="Compara dois resultados JSON em vez de medir")
+    parser.add_argument("--orcamento-partida", type=float, default=0.3,
+                        help="Tempo máximo de partida a frio, em segundos (padrão: 0.3)")
+    parser.add_argument("--repeticoes-partida", type=int, default=5)
+    parser.add_argument("--apenas-partida", action="store_true", help="Mede só o tempo de partida")
+    parser.add_argument("--sem-interface", action="store_true",
+                        help="Não mede a abertura da janela (máquinas sem display); sem esta opção, "
+                             "uma janela que não abre estoura o orçamento")
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        with open(args.comparar[0], encoding="utf-8") as f:
+            antes = json.load(f)
+        with open(args.comparar[1], encoding="utf-8") as f:
+            depois = json.load(f)
+        print(comparar(antes, depois))
+        return 0
+
+    # Medida antes de tudo, em processos separados, para não depender do que este já importou
+    partida = medir_partida(args.repeticoes_partida, args.orcamento_partida, not args.sem_interface)
+    if args.apenas_partida:
+        resultado = {"commit": _commit_atual(), "python": platform.python_version(), "partida": partida}
+    else:
+        diretorio = args.diretorio or tempfile.mkdtemp(prefix="benchmark_gabaritos_")
+        try:
+            # As mensagens de progresso do gerador não entram no resultado
+            with redirect_stdout(io.StringIO()):
+                resultado = executar_benchmark(args.escolas, args.turmas, args.alunos, args.amostras,
+                                               diretorio, partida)
+        finally:
+            if not args.diretorio:
+                shutil.rmtree(diretorio, ignore_errors=True)
+
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    return 0 if partida["dentro_do_orcamento"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -1,59 +1,625 @@
 import os
-import pandas as pd
-from docx import Document
-from docx.oxml.ns import qn
-import tkinter as tk
-from tkinter import filedialog, messagebox, Listbox, Scrollbar, Frame, Radiobutton, StringVar
+import sys
+import time
+import argparse
+import threading
+import queue
+import multiprocessing
+import gc
+import importlib
+import importlib.util
+import heapq
+import shutil
+from contextlib import redirect_stdout, contextmanager
 import re
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
+import csv
+import json
+import hashlib
+import io
+import struct
+import zipfile
+import zlib
+from functools import lru_cache
+from copy import deepcopy
+from collections import deque
+from itertools import groupby
 
-def sanitizar_nome(nome):
-    """Sanitiza o nome removendo caracteres especiais e aspas"""
+class ModuloSobDemanda:
+    """
+    Importa o módulo só no primeiro acesso a um atributo e a partir daí troca o nome global pelo
+    módulo de verdade: a janela e a linha de comando abrem sem esperar pandas, lxml, ReportLab e
+    tkinter, que só são carregados quando a leitura do CSV, a geração ou a interface precisam deles.
+    """
+    def __init__(self, nome, apelido):
+        self._nome = nome
+        self._apelido = apelido
+
+    def __getattr__(self, atributo):
+        modulo = importlib.import_module(self._nome)
+        globals()[self._apelido] = modulo
+        return getattr(modulo, atributo)
+
+np = ModuloSobDemanda('numpy', 'np')
+pd = ModuloSobDemanda('pandas', 'pd')
+etree = ModuloSobDemanda('lxml.etree', 'etree')
+canvas = ModuloSobDemanda('reportlab.pdfgen.canvas', 'canvas')
+colors = ModuloSobDemanda('reportlab.lib.colors', 'colors')
+tk = ModuloSobDemanda('tkinter', 'tk')
+ttk = ModuloSobDemanda('tkinter.ttk', 'ttk')
+filedialog = ModuloSobDemanda('tkinter.filedialog', 'filedialog')
+messagebox = ModuloSobDemanda('tkinter.messagebox', 'messagebox')
+
+# Mesmo valor de reportlab.lib.pagesizes.A4, sem importar o ReportLab
+MM = 72 / 2.54 * 0.1
+A4 = (210 * MM, 297 * MM)
+
+CARACTERES_INVALIDOS = re.compile(r'[<>:"/\\|?*]')
+CARACTERES_A_TRATAR = re.compile(r'[<>:"/\\|?*\']')  # Inválidos ou aspas
+
+def _sanitizar(nome):
     nome_str = str(nome)
-    # Remove aspas simples e duplas primeiro
-    nome_str = nome_str.replace("'", "").replace('"', "")
-    caracteres_invalidos = r'[<>:"/\\|?*]'
-    return re.sub(caracteres_invalidos, '_', nome_str).strip()
+    if CARACTERES_A_TRATAR.search(nome_str):  # A maioria dos nomes não tem nada a trocar
+        # Remove aspas simples e duplas primeiro
+        nome_str = CARACTERES_INVALIDOS.sub('_', nome_str.replace("'", "").replace('"', ""))
+    return nome_str.strip()
+
+@lru_cache(maxsize=4096)
+def sanitizar_nome(nome):
+    """Sanitiza o nome removendo caracteres especiais e aspas (memoizado: escolas e turmas se repetem)"""
+    return _sanitizar(nome)
 
-def get_unique_teachers(df):
-    """Get unique staff members from dataframe sorted alphabetically"""
+def sanitizar_nomes(valores):
+    """
+    sanitizar_nome de uma coluna inteira: cada valor distinto é sanitizado uma única vez e o
+    resultado volta para todas as linhas pelos códigos do factorize, numa indexação do numpy.
+    """
+    valores = np.asarray(valores, dtype=object)
+    codigos, unicos = pd.factorize(valores)
+    limpos = np.empty(len(unicos) + 1, dtype=object)
+    limpos[:len(unicos)] = [_sanitizar(valor) for valor in unicos]
+    resultado = limpos[codigos]
+    for posicao in np.flatnonzero(codigos < 0):  # Vazios (NaN/None) ficam fora do factorize
+        resultado[posicao] = _sanitizar(valores[posicao])
+    return resultado
+
+class NomesUnicos:
+    """
+    Nomes de arquivo distintos dentro de uma mesma pasta, na ordem em que chegam: o primeiro fica
+    como está e as repetições ganham _2, _3... A comparação ignora maiúsculas/minúsculas, como o
+    sistema de arquivos do Windows, para que um arquivo nunca sobrescreva outro.
+    """
+    def __init__(self):
+        self.usados = set()
+        self.proximo = {}  # Nome repetido -> próximo sufixo a tentar
+
+    def __call__(self, nome):
+        chave = nome.casefold()
+        if chave in self.usados:
+            numero = self.proximo.get(chave, 2)
+            while f"{nome}_{numero}".casefold() in self.usados:
+                numero += 1
+            self.proximo[chave] = numero + 1
+            nome = f"{nome}_{numero}"
+        self.usados.add(nome.casefold())
+        return nome
+
+@contextmanager
+def escrita_atomica(caminho):
+    """
+    Arquivo binário temporário ao lado de `caminho`, renomeado para ele só no fim do bloco `with`:
+    uma queda no meio da gravação nunca deixa o arquivo final pela metade.
+    """
+    pasta, nome = os.path.split(caminho)
+    temporario = os.path.join(pasta, f".{nome}.{os.getpid()}.tmp")
+    try:
+        with open(temporario, 'wb') as f:
+            yield f
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def get_unique_teachers(df, por_escola=False):
+    """Get unique staff members from dataframe sorted alphabetically (per school, keeping ESCOLA, with por_escola)"""
+    escola = ['ESCOLA'] if por_escola else []
     # Check which format we're dealing with
     if 'CPF DO PROFESSOR' in df.columns:
-        funcionarios = df.drop_duplicates(subset=['NOME DO PROFESSOR', 'CPF DO PROFESSOR'])[['NOME DO PROFESSOR', 'CPF DO PROFESSOR']]
+        colunas = escola + ['NOME DO PROFESSOR', 'CPF DO PROFESSOR']
+        funcionarios = df.drop_duplicates(subset=colunas)[colunas]
         funcionarios = funcionarios.rename(columns={'NOME DO PROFESSOR': 'NOME DO FUNCIONÁRIO'})
     else:
         # For old format
-        funcionarios = df.drop_duplicates(subset=['PROFESSOR REGENTE'])[['PROFESSOR REGENTE']]
+        colunas = escola + ['PROFESSOR REGENTE']
+        funcionarios = df.drop_duplicates(subset=colunas)[colunas]
         funcionarios = funcionarios.rename(columns={'PROFESSOR REGENTE': 'NOME DO FUNCIONÁRIO'})
-    return funcionarios.sort_values('NOME DO FUNCIONÁRIO')
+    return funcionarios.sort_values(escola + ['NOME DO FUNCIONÁRIO'])
 
 def detect_csv_format(df):
-    """Detect which CSV format we're dealing with"""
-    if {'NOME DO PROFESSOR', 'CPF DO PROFESSOR', 'TURNO'}.issubset(df.columns):
+    """Detect which CSV format we're dealing with (accepts a DataFrame or just the column names)"""
+    colunas = set(getattr(df, 'columns', df))
+    if {'NOME DO PROFESSOR', 'CPF DO PROFESSOR', 'TURNO'}.issubset(colunas):
         return "professor_format"
-    elif {'PROFESSOR REGENTE', 'NOME DO ALUNO', 'ETAPA DE ENSINO'}.issubset(df.columns):
+    elif {'PROFESSOR REGENTE', 'NOME DO ALUNO', 'ETAPA DE ENSINO'}.issubset(colunas):
         return "aluno_format"
     else:
         raise ValueError("Formato de CSV não reconhecido")
 
+# Colunas usadas na geração, por formato (nomes originais do CSV)
+COLUNAS_POR_FORMATO = {
+    "aluno_format": ['ESCOLA', 'TURMA', 'NOME DO ALUNO', 'PROFESSOR REGENTE', 'ETAPA DE ENSINO'],
+    "professor_format": ['NOME DA ESCOLA', 'NOME DO PROFESSOR', 'CPF DO PROFESSOR', 'ETAPA', 'TURMA', 'TURNO'],
+}
+# Normalização dos nomes do formato de funcionários para os nomes usados no resto do código
+RENOMEAR_PROFESSOR_FORMAT = {'ETAPA': 'ETAPA DE ENSINO', 'NOME DA ESCOLA': 'ESCOLA'}
+TAMANHO_BLOCO_CSV = 100_000  # linhas por bloco na leitura do CSV
+# Só campos vazios são valores ausentes: "NA", "NULL" etc. são nomes válidos (e o IndiceCsv os lista)
+OPCOES_LEITURA_CSV = dict(sep=';', encoding='utf-8', dtype=str, keep_default_na=False, na_values=[''])
+
+def ler_cabecalho_csv(csv_path):
+    """Nomes das colunas do CSV, lendo só a primeira linha"""
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        return next(csv.reader(f, delimiter=';'), [])
+
+def _colunas_para_leitura(csv_format):
+    """(usecols com os nomes originais, renomeação para os nomes normalizados) de um formato"""
+    renomear = RENOMEAR_PROFESSOR_FORMAT if csv_format == "professor_format" else {}
+    return list(COLUNAS_POR_FORMATO[csv_format]), renomear
+
+def ler_csv_em_blocos(csv_path, tamanho_bloco=TAMANHO_BLOCO_CSV):
+    """
+    Lê o CSV em blocos, já com os nomes de coluna normalizados.
+    Só as colunas necessárias são lidas. Retorna (formato, gerador de blocos).
+    """
+    csv_format = detect_csv_format(ler_cabecalho_csv(csv_path))
+    usecols, renomear = _colunas_para_leitura(csv_format)
+
+    def blocos():
+        for bloco in pd.read_csv(csv_path, usecols=usecols, chunksize=tamanho_bloco, **OPCOES_LEITURA_CSV):
+            yield bloco.rename(columns=renomear) if renomear else bloco
+
+    return csv_format, blocos()
+
+def carregar_registros(csv_path, escolas_selecionadas, etapas_selecionadas, tamanho_bloco=TAMANHO_BLOCO_CSV,
+                       cache=None):
+    """
+    Lê o CSV em blocos filtrando escolas/etapas durante a leitura: a memória fica limitada
+    às linhas selecionadas, não ao tamanho do arquivo. Com `cache` (CacheCsv), a tabela
+    normalizada vem do cache local e só é filtrada; sem entrada no cache, o arquivo inteiro é
+    carregado uma vez para criá-la.
+    Retorna (registros selecionados, pares (escola, turma) de todo o arquivo); os pares são None
+    quando não há seleção, pois aí os registros já têm todos (ver PastasSaida).
+    """
+    escopo_total = escolas_selecionadas is None and not etapas_selecionadas
+    if cache is not None:
+        _, df = carregar_tabela(csv_path, cache)
+        pares = None if escopo_total else pares_escola_turma(df)
+        return df[_mascara_selecao(df, escolas_selecionadas, etapas_selecionadas)], pares
+
+    # Se a interface já indexou o arquivo, só os trechos das escolas/etapas selecionadas são lidos
+    indice = obter_indice_csv(csv_path, construir=False)
+    if indice is not None and indice.trechos is not None and not escopo_total:
+        return indice.ler_registros(escolas_selecionadas, etapas_selecionadas), indice.pares
+
+    _, blocos = ler_csv_em_blocos(csv_path, tamanho_bloco=tamanho_bloco)
+    selecionados, colunas = [], None
+    pares = None if escopo_total else set()
+    for bloco in blocos:
+        colunas = bloco.columns
+        if pares is not None:
+            pares.update(pares_escola_turma(bloco))
+        mask = _mascara_selecao(bloco, escolas_selecionadas, etapas_selecionadas)
+        if mask.any():
+            selecionados.append(bloco[mask])
+    if not selecionados:
+        return pd.DataFrame(columns=colunas), pares
+    return pd.concat(selecionados, ignore_index=True), pares
+
+def pares_escola_turma(df):
+    """Pares (escola, turma) distintos do DataFrame, sem as linhas de escola vazia"""
+    pares = df[['ESCOLA', 'TURMA']].drop_duplicates()
+    pares = pares[pares['ESCOLA'].notna()]
+    return set(zip(pares['ESCOLA'], pares['TURMA']))
+
+class CacheCsv:
+    """
+    Cache local do CSV já normalizado (só as colunas usadas, ESCOLA/TURMA/ETAPA como category).
+    Usa Feather quando o pyarrow está instalado e, sem ele, o pickle do pandas, que também é
+    binário e preserva os dtypes. A entrada é identificada pelo hash do conteúdo; caminho,
+    tamanho e mtime servem para não recalcular o hash quando o arquivo não mudou.
+    Só a entrada mais recente de cada arquivo é mantida: quando ele muda, a anterior é apagada.
+    """
+    VERSAO = 1
+    COLUNAS_CATEGORIA = ['ESCOLA', 'TURMA', 'ETAPA DE ENSINO']
+
+    def __init__(self, diretorio=None):
+        self.diretorio = diretorio or os.path.join(os.path.expanduser("~"), ".cache", "gerador_gabaritos")
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._caminho_indice = os.path.join(self.diretorio, "indice.json")
+        self.extensao = ".feather" if importlib.util.find_spec("pyarrow") is not None else ".pkl"
+
+    def _ler_indice(self):
+        try:
+            with open(self._caminho_indice, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _hash_conteudo(csv_path):
+        h = hashlib.sha1()
+        with open(csv_path, 'rb') as f:
+            for parte in iter(lambda: f.read(1 << 20), b''):
+                h.update(parte)
+        return h.hexdigest()
+
+    def chave(self, csv_path, calcular=True):
+        """
+        Hash do conteúdo, recalculado só quando caminho, tamanho ou mtime mudam.
+        Sem `calcular`, devolve None em vez de ler o arquivo inteiro para recalculá-lo.
+        """
+        caminho = os.path.abspath(csv_path)
+        info = os.stat(caminho)
+        indice = self._ler_indice()
+        entrada = indice.get(caminho)
+        if entrada and entrada['tamanho'] == info.st_size and entrada['mtime_ns'] == info.st_mtime_ns:
+            return entrada['hash']
+        if not calcular:
+            return None
+        conteudo = self._hash_conteudo(caminho)
+        indice[caminho] = {'tamanho': info.st_size, 'mtime_ns': info.st_mtime_ns, 'hash': conteudo}
+        if entrada and entrada['hash'] != conteudo:
+            self._remover_entrada(entrada['hash'], indice)
+        with escrita_atomica(self._caminho_indice) as f:
+            f.write(json.dumps(indice).encode('utf-8'))
+        return conteudo
+
+    def _remover_entrada(self, chave, indice):
+        """Apaga os arquivos de uma versão antiga, se nenhum outro CSV do índice tiver o mesmo conteúdo"""
+        if any(entrada['hash'] == chave for entrada in indice.values()):
+            return
+        for caminho in self._caminhos(chave):
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    def _caminhos(self, chave):
+        base = os.path.join(self.diretorio, f"{chave}_v{self.VERSAO}")
+        return base + self.extensao, base + ".json"
+
+    def carregar(self, csv_path, calcular_hash=True):
+        """
+        Retorna (formato, DataFrame) do cache ou None se não houver entrada válida.
+        Sem `calcular_hash`, só encontra a entrada se o arquivo não mudou desde que foi indexado.
+        """
+        chave = self.chave(csv_path, calcular_hash)
+        if chave is None:
+            return None
+        caminho_dados, caminho_meta = self._caminhos(chave)
+        if not (os.path.exists(caminho_dados) and os.path.exists(caminho_meta)):
+            return None
+        with open(caminho_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        if self.extensao == ".feather":
+            df = pd.read_feather(caminho_dados)
+        else:
+            df = pd.read_pickle(caminho_dados)
+        return meta['formato'], df
+
+    def salvar(self, csv_path, csv_format, df):
+        # Os metadados vão por último: uma entrada só é válida com os dois arquivos completos
+        caminho_dados, caminho_meta = self._caminhos(self.chave(csv_path))
+        with escrita_atomica(caminho_dados) as f:
+            if self.extensao == ".feather":
+                df.reset_index(drop=True).to_feather(f)
+            else:
+                df.to_pickle(f)
+        with escrita_atomica(caminho_meta) as f:
+            f.write(json.dumps({'formato': csv_format, 'csv': os.path.abspath(csv_path)}).encode('utf-8'))
+
+def carregar_tabela(csv_path, cache):
+    """CSV completo normalizado (colunas usadas), vindo do cache ou lido em blocos e guardado nele"""
+    em_cache = cache.carregar(csv_path)
+    if em_cache is not None:
+        return em_cache
+    csv_format, blocos = ler_csv_em_blocos(csv_path)
+    df = pd.concat(list(blocos), ignore_index=True)
+    for coluna in CacheCsv.COLUNAS_CATEGORIA:
+        df[coluna] = df[coluna].astype('category')
+    cache.salvar(csv_path, csv_format, df)
+    return csv_format, df
+
+def _mascara_selecao(df, escolas_selecionadas, etapas_selecionadas):
+    # isin já é falso para valores vazios (NaN), o que também funciona com colunas category
+    if escolas_selecionadas is None:
+        mask = df['ESCOLA'].notna()
+    else:
+        mask = df['ESCOLA'].isin(escolas_selecionadas)
+    if etapas_selecionadas:
+        mask &= df['ETAPA DE ENSINO'].isin(etapas_selecionadas)
+    return mask
+
+class IndiceCsv:
+    """
+    Escolas e etapas de um CSV, obtidas numa única passada que só olha as colunas de escola e etapa,
+    e os trechos do arquivo (em bytes) de cada par (escola, etapa). Preenche a interface sem
+    carregar o arquivo no pandas e, depois, permite ler só as linhas selecionadas.
+    """
+    LIMITE_TRECHOS = 50_000  # Acima disso (arquivo muito embaralhado) os trechos são descartados
+
+    def __init__(self, csv_path):
+        self.csv_path = os.path.abspath(csv_path)
+        info = os.stat(self.csv_path)
+        self.assinatura = (info.st_size, info.st_mtime_ns)
+
+        with open(self.csv_path, 'rb') as f:
+            self.cabecalho = f.readline()
+            colunas = next(csv.reader([self.cabecalho.decode('utf-8-sig')], delimiter=';'), [])
+            self.formato = detect_csv_format(colunas)
+            originais = {normalizado: original for original, normalizado
+                         in RENOMEAR_PROFESSOR_FORMAT.items()} if self.formato == "professor_format" else {}
+            posicoes = (colunas.index(originais.get('ESCOLA', 'ESCOLA')),
+                        colunas.index(originais.get('ETAPA DE ENSINO', 'ETAPA DE ENSINO')),
+                        colunas.index('TURMA'))
+            # Sem aspas no arquivo não há campos com ';' ou quebra de linha: basta dividir as linhas.
+            # Se aparecer uma aspa, a varredura recomeça com o módulo csv.
+            inicio = f.tell()
+            varredura = self._varrer_linhas(f, posicoes)
+            if varredura is None:
+                f.seek(inicio)
+                varredura = self._varrer_com_csv(f, posicoes)
+        trechos, pares = varredura
+
+        # Campos vazios viram NaN no pandas e não entram nas listas
+        self.escolas = sorted({escola for escola, _ in trechos if escola})
+        self.etapas = sorted({etapa for _, etapa in trechos if etapa})
+        # Pares (escola, turma) do arquivo inteiro, como pares_escola_turma, para as PastasSaida
+        self.pares = {(escola, turma or None) for escola, turma in pares if escola}
+        total = sum(len(lista) for lista in trechos.values())
+        self.trechos = trechos if total <= self.LIMITE_TRECHOS else None
+
+    @staticmethod
+    def _varrer(registros, posicoes):
+        """
+        Agrupa (início, fim, campos) consecutivos da mesma escola/etapa em trechos.
+        Retorna (trechos, pares (escola, turma) distintos).
+        """
+        i_escola, i_etapa, i_turma = posicoes
+        trechos, pares = {}, set()
+        chave_atual, trecho_atual, par_atual = None, None, None
+        for inicio, fim, campos in registros:
+            try:
+                chave = (campos[i_escola], campos[i_etapa])
+                par = (chave[0], campos[i_turma])
+            except IndexError:
+                campos = campos + [campos[0][:0]] * (max(posicoes) + 1 - len(campos))
+                chave = (campos[i_escola], campos[i_etapa])
+                par = (chave[0], campos[i_turma])
+            if par != par_atual:
+                pares.add(par)
+                par_atual = par
+            if chave == chave_atual and trecho_atual[1] == inicio:
+                trecho_atual[1] = fim  # Caso comum: linhas seguidas da mesma escola/etapa
+                continue
+            lista = trechos.setdefault(chave, [])
+            if lista and lista[-1][1] == inicio:
+                lista[-1][1] = fim
+            else:
+                lista.append([inicio, fim])
+            chave_atual, trecho_atual = chave, lista[-1]
+        return trechos, pares
+
+    def _varrer_linhas(self, f, posicoes):
+        """Trechos dividindo cada linha por ';', ou None se o arquivo tiver aspas"""
+        maximo = max(posicoes) + 1
+        com_aspas = []
+        def registros():
+            inicio = f.tell()
+            for linha in f:
+                if b'"' in linha:
+                    com_aspas.append(inicio)
+                    return
+                fim = inicio + len(linha)
+                campos = linha.rstrip(b'\r\n').split(b';', maximo)
+                if campos != [b'']:
+                    yield inicio, fim, campos
+                inicio = fim
+        trechos, pares = self._varrer(registros(), posicoes)
+        if com_aspas:
+            return None
+        return ({(escola.decode('utf-8'), etapa.decode('utf-8')): lista for (escola, etapa), lista in trechos.items()},
+                {(escola.decode('utf-8'), turma.decode('utf-8')) for escola, turma in pares})
+
+    def _varrer_com_csv(self, f, posicoes):
+        # Fim (em bytes) da última linha entregue ao csv.reader, que só lê as linhas do registro atual
+        fim = [f.tell()]
+        def linhas():
+            for linha in f:
+                fim[0] += len(linha)
+                yield linha.decode('utf-8')
+
+        def registros():
+            inicio = fim[0]
+            for campos in csv.reader(linhas(), delimiter=';'):
+                if campos:
+                    yield inicio, fim[0], campos
+                inicio = fim[0]
+        return self._varrer(registros(), posicoes)
+
+    def atualizado(self):
+        try:
+            info = os.stat(self.csv_path)
+        except OSError:
+            return False
+        return self.assinatura == (info.st_size, info.st_mtime_ns)
+
+    def ler_registros(self, escolas_selecionadas, etapas_selecionadas):
+        """Mesmo resultado de carregar_registros, lendo do disco só os trechos selecionados"""
+        escolas = set(escolas_selecionadas) if escolas_selecionadas is not None else None
+        etapas = set(etapas_selecionadas) if etapas_selecionadas else None
+        selecionados = sorted(
+            trecho
+            for (escola, etapa), lista in self.trechos.items()
+            if escola and (escolas is None or escola in escolas) and (etapas is None or etapa in etapas)
+            for trecho in lista)
+
+        # Os trechos são lidos do disco à medida que o pandas consome os blocos: na memória ficam
+        # só os registros já convertidos, como em carregar_registros, e não uma cópia dos bytes
+        usecols, renomear = _colunas_para_leitura(self.formato)
+        with open(self.csv_path, 'rb') as f:
+            leitor = io.BufferedReader(_LeitorTrechos(f, [(0, len(self.cabecalho))] + selecionados))
+            blocos = list(pd.read_csv(leitor, usecols=usecols, chunksize=TAMANHO_BLOCO_CSV, **OPCOES_LEITURA_CSV))
+        df = pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame(columns=usecols)
+        return df.rename(columns=renomear) if renomear else df
+
+class _LeitorTrechos(io.RawIOBase):
+    """Arquivo só de leitura com os trechos (início, fim) de `arquivo` emendados, lidos sob demanda"""
+    def __init__(self, arquivo, trechos):
+        self.arquivo = arquivo
+        self.trechos = iter(trechos)
+        self.restante = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        while not self.restante:
+            trecho = next(self.trechos, None)
+            if trecho is None:
+                return 0
+            self.arquivo.seek(trecho[0])
+            self.restante = trecho[1] - trecho[0]
+        lidos = self.arquivo.readinto(memoryview(destino)[:self.restante])
+        self.restante = self.restante - lidos if lidos else 0  # Arquivo truncado: 0 encerra a leitura
+        return lidos
+
+# Índices dos CSVs abertos nesta sessão (caminho absoluto -> IndiceCsv)
+_indices_csv = {}
+
+def obter_indice_csv(csv_path, construir=True):
+    """IndiceCsv do arquivo, reaproveitado enquanto ele não mudar no disco (None se não houver e construir=False)"""
+    caminho = os.path.abspath(csv_path)
+    indice = _indices_csv.get(caminho)
+    if indice is not None and indice.atualizado():
+        return indice
+    if not construir:
+        return None
+    _indices_csv[caminho] = indice = IndiceCsv(caminho)
+    return indice
+
 # --- FUNÇÃO DE SUBSTITUIÇÃO COM A CORREÇÃO DA ORDEM DE RECONHECIMENTO ---
+class SubstituidorPlaceholders:
+    """
+    Localiza todos os placeholders de um texto em uma única varredura.
+    As chaves viram uma expressão regular em forma de árvore de prefixos (trie): o custo da
+    varredura não cresce com o número de placeholders, e a busca gulosa garante que a MAIOR
+    chave vença ('$VARIÁVEL NOME DO ALUNO 2' antes de '$VARIÁVEL NOME DO ALUNO').
+    """
+    def __init__(self, chaves):
+        self.chaves = tuple(chaves)
+        trie = {}
+        for chave in self.chaves:
+            no = trie
+            for caractere in chave:
+                no = no.setdefault(caractere, {})
+            no[''] = True  # marca o fim de uma chave
+        padrao = self._montar_padrao(trie)
+        self.regex = re.compile(padrao) if padrao else None
+
+    @classmethod
+    def _montar_padrao(cls, no):
+        ramos = [re.escape(caractere) + cls._montar_padrao(filho)
+                 for caractere, filho in sorted(no.items()) if caractere]
+        if not ramos:
+            return ''
+        corpo = ramos[0] if len(ramos) == 1 else '(?:' + '|'.join(ramos) + ')'
+        # Se uma chave termina aqui, o restante é opcional (guloso: tenta a chave mais longa primeiro)
+        return f'(?:{corpo})?' if '' in no else corpo
+
+    def localizar(self, texto):
+        """Retorna os matches (posição e chave) de todos os placeholders do texto"""
+        return list(self.regex.finditer(texto)) if self.regex else []
+
+@lru_cache(maxsize=32)
+def obter_substituidor(chaves):
+    """Substituidor compilado uma vez para cada conjunto de chaves"""
+    return SubstituidorPlaceholders(chaves)
+
+W_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TAG_TEXTBOX = f"{W_NAMESPACE}txbxContent"
+TAG_PARAGRAPH = f"{W_NAMESPACE}p"
+TAG_TEXT = f"{W_NAMESPACE}t"
+ATRIBUTO_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+PLACEHOLDERS_GABARITO = (
+    '$VARIÁVEL ESCOLA',
+    '$VARIÁVEL TURMA',
+    '$VARIÁVEL PROFESSOR REGENTE',
+    '$VARIÁVEL NOME DO ALUNO',
+    '$VARIÁVEL NOME DO ALUNO 2',
+)
+
+def _textos_do_paragrafo(p_element):
+    """Elementos w:t do próprio parágrafo (caixas de texto internas têm seus próprios w:p)"""
+    return [t for t in p_element.iter(TAG_TEXT)
+            if next(t.iterancestors(TAG_PARAGRAPH)) is p_element]
+
+def _definir_texto(t_element, texto):
+    t_element.text = texto
+    t_element.set(ATRIBUTO_XML_SPACE, 'preserve')
+
+def _segmentar_textos(textos, matches):
+    """
+    Distribui os placeholders encontrados no texto completo do parágrafo entre os w:t.
+    Cada w:t vira uma lista de segmentos (literal, chave): o valor de um placeholder fica no
+    w:t onde ele começa e os trechos dele nos w:t seguintes são removidos.
+    Retorna None para os w:t que não são tocados por nenhum placeholder.
+    """
+    texto_completo = "".join(textos)
+    segmentos_por_no = []
+    j, pos = 0, 0
+    for texto in textos:
+        inicio, fim = pos, pos + len(texto)
+        segmentos, cursor, tocado = [], inicio, False
+        while j < len(matches) and matches[j].start() < fim:
+            m = matches[j]
+            tocado = True
+            if m.start() >= inicio:
+                segmentos.append((texto_completo[cursor:m.start()], None))
+                segmentos.append(("", m.group(0)))
+            cursor = min(m.end(), fim)
+            if m.end() > fim:
+                break  # o placeholder continua no próximo w:t
+            j += 1
+        segmentos.append((texto_completo[cursor:fim], None))
+        segmentos_por_no.append(segmentos if tocado else None)
+        pos = fim
+    return segmentos_por_no
+
+def _montar_texto(segmentos, dados):
+    return "".join(literal if chave is None else str(dados.get(chave, chave))
+                   for literal, chave in segmentos)
+
+def _substituir_no_paragrafo(p_element, dados):
+    """Substitui os placeholders reescrevendo apenas os w:t que eles ocupam"""
+    t_elements = _textos_do_paragrafo(p_element)
+    textos = [t.text or "" for t in t_elements]
+    if '$' not in "".join(textos):
+        return
+    matches = obter_substituidor(tuple(dados)).localizar("".join(textos))
+    if not matches:
+        return
+    for t_element, segmentos in zip(t_elements, _segmentar_textos(textos, matches)):
+        if segmentos is not None:
+            _definir_texto(t_element, _montar_texto(segmentos, dados))
+
 def substituir_variaveis_em_tudo(doc, dados):
     """
     Substitui placeholders em todo o documento, incluindo parágrafos, tabelas e caixas de texto.
-    A correção crucial aqui é ordenar as chaves por comprimento para evitar substituições parciais.
+    A correção crucial aqui é reconhecer sempre a chave mais longa para evitar substituições parciais.
+    Só os w:t cobertos por placeholders são reescritos, preservando os runs e a formatação.
     """
-    # Helper function para fazer a substituição de forma segura
-    def substituir_texto(texto_original, dados_substituicao):
-        # ORDENA AS CHAVES (placeholders) POR COMPRIMENTO, DA MAIOR PARA A MENOR.
-        # Isso garante que '$VARIÁVEL NOME DO ALUNO 2' seja processado ANTES de '$VARIÁVEL NOME DO ALUNO'.
-        for key in sorted(dados_substituicao.keys(), key=len, reverse=True):
-            value = dados_substituicao[key]
-            texto_original = texto_original.replace(key, str(value))
-        return texto_original
-
     # 1. Substituição em parágrafos e tabelas do corpo principal
     all_paragraphs = list(doc.paragraphs)
     for table in doc.tables:
@@ -62,220 +628,1945 @@ def substituir_variaveis_em_tudo(doc, dados):
                 all_paragraphs.extend(cell.paragraphs)
     
     for p in all_paragraphs:
-        full_text = "".join(run.text for run in p.runs)
-        if '$' in full_text:
-            novo_texto = substituir_texto(full_text, dados)
-            # Apenas modifica o parágrafo se houver mudança, para preservar formatação
-            if novo_texto != full_text:
-                for run in p.runs:
-                    run.text = ''
-                p.add_run(novo_texto)
+        _substituir_no_paragrafo(p._p, dados)
 
     # 2. Substituição DENTRO DE CAIXAS DE TEXTO (acessando o XML)
-    W_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
-    TAG_TEXTBOX = f"{W_NAMESPACE}txbxContent"
-    TAG_PARAGRAPH = f"{W_NAMESPACE}p"
-    TAG_RUN = f"{W_NAMESPACE}r"
-    TAG_TEXT = f"{W_NAMESPACE}t"
-
     for txbx in doc.element.body.iter(TAG_TEXTBOX):
         for p_element in txbx.iter(TAG_PARAGRAPH):
-            full_text = ""
-            all_t_elements = []
-            for r_element in p_element.iter(TAG_RUN):
-                for t_element in r_element.iter(TAG_TEXT):
-                    all_t_elements.append(t_element)
-                    if t_element.text:
-                        full_text += t_element.text
-
-            if '$' in full_text:
-                novo_texto = substituir_texto(full_text, dados)
-                if novo_texto != full_text:
-                    for i, t_element in enumerate(all_t_elements):
-                        if i == 0:
-                            t_element.text = novo_texto
-                        else:
-                            t_element.text = ""
+            _substituir_no_paragrafo(p_element, dados)
     
     return doc
 
-def criar_lista_presenca(escola, nome_grupo, items, diretorio_saida, titulo_lista="Lista de Presença", cores=None, data_lista=None, is_teacher_list=False, turma=None):
-    items = sorted(items) if not is_teacher_list else items
-    caminho_arquivo = os.path.join(diretorio_saida, f"lista_presenca_{nome_grupo}.pdf")
-    c = canvas.Canvas(caminho_arquivo, pagesize=A4)
+class PacoteDocx:
+    """
+    Pacote .docx do modelo lido uma única vez.
+    Os membros que não mudam entre alunos (estilos, mídia, fontes, relacionamentos) são guardados
+    já comprimidos e copiados byte a byte; só a parte principal é comprimida a cada documento.
+    """
+    ASSINATURA_LOCAL = 0x04034b50
+    ASSINATURA_CENTRAL = 0x02014b50
+    ASSINATURA_FIM = 0x06054b50
+
+    def __init__(self, caminho, nivel_compressao=6):
+        self.nivel_compressao = nivel_compressao
+        with open(caminho, 'rb') as f:
+            bruto = f.read()
+        self.impressao = hashlib.sha1(bruto).hexdigest()  # Identifica o conteúdo do modelo
+
+        prefixo, diretorio, offset = [], [], 0
+        with zipfile.ZipFile(io.BytesIO(bruto)) as zf:
+            self.parte_principal = self._localizar_parte_principal(zf)
+            self.xml_principal = zf.read(self.parte_principal)
+            membros = zf.infolist()
+            for info in membros:
+                if info.filename == self.parte_principal:
+                    self._info_principal = info
+                    continue
+                # Dados comprimidos originais, logo após o cabeçalho local do membro
+                tam_nome, tam_extra = struct.unpack('<HH', bruto[info.header_offset + 26:info.header_offset + 30])
+                inicio = info.header_offset + 30 + tam_nome + tam_extra
+                dados = bruto[inicio:inicio + info.compress_size]
+                local, central = self._cabecalhos(info, info.compress_type, info.CRC,
+                                                  info.compress_size, info.file_size, offset)
+                prefixo += [local, dados]
+                diretorio.append(central)
+                offset += len(local) + len(dados)
+        self._prefixo = b"".join(prefixo)
+        self._diretorio = b"".join(diretorio)
+        self._total_membros = len(membros)
+
+    @staticmethod
+    def _localizar_parte_principal(zf):
+        rels = etree.fromstring(zf.read('_rels/.rels'))
+        for rel in rels:
+            if rel.get('Type', '').endswith('/officeDocument'):
+                return rel.get('Target').lstrip('/')
+        return 'word/document.xml'
+
+    @classmethod
+    def _cabecalhos(cls, info, metodo, crc, tam_comprimido, tam_original, offset):
+        """Cabeçalho local e entrada do diretório central de um membro"""
+        try:
+            nome, flags = info.filename.encode('ascii'), 0
+        except UnicodeEncodeError:
+            nome, flags = info.filename.encode('utf-8'), 0x800
+        ano, mes, dia, hora, minuto, segundo = info.date_time
+        data_dos = (ano - 1980) << 9 | mes << 5 | dia
+        hora_dos = hora << 11 | minuto << 5 | segundo // 2
+        local = struct.pack('<IHHHHHIIIHH', cls.ASSINATURA_LOCAL, 20, flags, metodo, hora_dos, data_dos,
+                            crc, tam_comprimido, tam_original, len(nome), 0) + nome
+        central = struct.pack('<IHHHHHHIIIHHHHHII', cls.ASSINATURA_CENTRAL, 20, 20, flags, metodo,
+                              hora_dos, data_dos, crc, tam_comprimido, tam_original, len(nome),
+                              0, 0, 0, 0, info.external_attr, offset) + nome
+        return local, central
+
+    def montar(self, xml_principal):
+        """Bytes do .docx completo com a parte principal informada"""
+        if self.nivel_compressao > 0:
+            compressor = zlib.compressobj(self.nivel_compressao, zlib.DEFLATED, -15)
+            dados = compressor.compress(xml_principal) + compressor.flush()
+            metodo = zipfile.ZIP_DEFLATED
+        else:
+            dados, metodo = xml_principal, zipfile.ZIP_STORED
+        local, central = self._cabecalhos(self._info_principal, metodo, zlib.crc32(xml_principal),
+                                          len(dados), len(xml_principal), len(self._prefixo))
+        inicio_diretorio = len(self._prefixo) + len(local) + len(dados)
+        tam_diretorio = len(self._diretorio) + len(central)
+        fim = struct.pack('<IHHHHIIH', self.ASSINATURA_FIM, 0, 0, self._total_membros,
+                          self._total_membros, tam_diretorio, inicio_diretorio, 0)
+        return b"".join((self._prefixo, local, dados, self._diretorio, central, fim))
+
+class ModeloCompilado:
+    """
+    Modelo Word lido uma única vez por execução.
+    Os placeholders (corpo, tabelas e caixas de texto) são localizados na criação e cada w:t
+    afetado guarda seus segmentos; cada aluno só reescreve esses w:t e salva, sem reabrir o arquivo.
+    """
+    extensao = ".docx"
+
+    def __init__(self, modelo_path, chaves=PLACEHOLDERS_GABARITO, nivel_compressao=6):
+        self.modelo_path = modelo_path
+        self.pacote = PacoteDocx(modelo_path, nivel_compressao)
+        self.impressao = self.pacote.impressao
+        self.raiz = etree.fromstring(self.pacote.xml_principal)
+        self.slots = []  # (w:t, segmentos)
+        substituidor = obter_substituidor(tuple(chaves))
+
+        # body.iter alcança parágrafos do corpo, células de tabela e w:txbxContent
+        for p_element in self.raiz.find(f"{W_NAMESPACE}body").iter(TAG_PARAGRAPH):
+            t_elements = _textos_do_paragrafo(p_element)
+            textos = [t.text or "" for t in t_elements]
+            texto_modelo = "".join(textos)
+            if '$' not in texto_modelo:
+                continue
+            matches = substituidor.localizar(texto_modelo)
+            if not matches:
+                continue
+            for t_element, segmentos in zip(t_elements, _segmentar_textos(textos, matches)):
+                if segmentos is not None:
+                    self.slots.append((t_element, segmentos))
+
+    def preencher(self, dados):
+        """Preenche os placeholders com os dados de um aluno (ou par de alunos)"""
+        for t_element, segmentos in self.slots:
+            _definir_texto(t_element, _montar_texto(segmentos, dados))
+        return self
+
+    def serializar(self):
+        """Bytes do .docx preenchido: só a parte principal é serializada e comprimida"""
+        return self.pacote.montar(etree.tostring(self.raiz, xml_declaration=True,
+                                                 encoding='UTF-8', standalone=True))
+
+    def novo_agregado(self):
+        return DocumentoAgregado(self)
+
+    def salvar(self, destino):
+        """Salva o documento preenchido (caminho ou objeto de arquivo)"""
+        dados = self.serializar()
+        if hasattr(destino, 'write'):
+            destino.write(dados)
+        else:
+            with escrita_atomica(destino) as f:
+                f.write(dados)
+
+class DocumentoAgregado:
+    """
+    Vários gabaritos em um único .docx, um por página.
+    A cada `adicionar` o corpo do modelo, no estado preenchido atual, é copiado para o final;
+    as cópias seguintes começam em nova página.
+    """
+    TAG_BODY = f"{W_NAMESPACE}body"
+    TAG_SECTPR = f"{W_NAMESPACE}sectPr"
+    TAG_PPR = f"{W_NAMESPACE}pPr"
+    TAG_DOCPR = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}docPr"
+    # Elementos que, pelo esquema, vêm antes de w:pageBreakBefore dentro de w:pPr
+    ANTES_DA_QUEBRA = {f"{W_NAMESPACE}pStyle", f"{W_NAMESPACE}keepNext", f"{W_NAMESPACE}keepLines"}
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        corpo_modelo = modelo.raiz.find(self.TAG_BODY)
+        self._conteudo_modelo = [el for el in corpo_modelo if el.tag != self.TAG_SECTPR]
+
+        # Raiz própria, com o corpo vazio (mantendo apenas a configuração de seção final)
+        self.raiz = etree.Element(modelo.raiz.tag, nsmap=modelo.raiz.nsmap)
+        self.raiz.attrib.update(modelo.raiz.attrib)
+        for filho in modelo.raiz:
+            if filho.tag != self.TAG_BODY:
+                self.raiz.append(deepcopy(filho))
+        self.corpo = etree.SubElement(self.raiz, self.TAG_BODY)
+        for el in corpo_modelo:
+            if el.tag == self.TAG_SECTPR:
+                self.corpo.append(deepcopy(el))
+        self.total = 0
+        self._proximo_id_desenho = 1
+
+    def _inserir(self, elemento):
+        sect_pr = self.corpo.find(self.TAG_SECTPR)
+        if sect_pr is not None:
+            sect_pr.addprevious(elemento)
+        else:
+            self.corpo.append(elemento)
+
+    def _iniciar_nova_pagina(self, primeiro):
+        if primeiro.tag == TAG_PARAGRAPH:
+            # Quebra antes do primeiro parágrafo: não acrescenta linhas ao layout do modelo
+            p_pr = primeiro.find(self.TAG_PPR)
+            if p_pr is None:
+                p_pr = etree.Element(self.TAG_PPR)
+                primeiro.insert(0, p_pr)
+            posicao = sum(1 for filho in p_pr if filho.tag in self.ANTES_DA_QUEBRA)
+            p_pr.insert(posicao, etree.Element(f"{W_NAMESPACE}pageBreakBefore"))
+        else:
+            quebra = etree.Element(TAG_PARAGRAPH)
+            run = etree.SubElement(quebra, f"{W_NAMESPACE}r")
+            etree.SubElement(run, f"{W_NAMESPACE}br").set(f"{W_NAMESPACE}type", "page")
+            self._inserir(quebra)
+
+    def adicionar(self):
+        """Anexa uma cópia do modelo como está preenchido agora"""
+        copias = [deepcopy(el) for el in self._conteudo_modelo]
+        if not copias:
+            return
+        if self.total:
+            self._iniciar_nova_pagina(copias[0])
+        for copia in copias:
+            # Ids de desenhos/caixas de texto precisam ser únicos no documento
+            for doc_pr in copia.iter(self.TAG_DOCPR):
+                doc_pr.set('id', str(self._proximo_id_desenho))
+                self._proximo_id_desenho += 1
+            self._inserir(copia)
+        self.total += 1
+
+    def serializar(self):
+        return self.modelo.pacote.montar(etree.tostring(self.raiz, xml_declaration=True,
+                                                        encoding='UTF-8', standalone=True))
+
+    def salvar(self, destino):
+        """Salva o documento com todas as folhas adicionadas (caminho ou objeto de arquivo)"""
+        if hasattr(destino, 'write'):
+            destino.write(self.serializar())
+        else:
+            with escrita_atomica(destino) as f:
+                f.write(self.serializar())
+
+class EstiloLista:
+    """
+    Tudo o que não muda entre páginas e arquivos da lista de presença: cores da paleta,
+    geometria da tabela e posições do texto nas células (mesmas regras de Table/TableStyle
+    do ReportLab: VALIGN MIDDLE, padding 6/3 e linha de cabeçalho com BOTTOMPADDING 8).
+    """
     largura, altura = A4
-    margem_esquerda, margem_superior, margem_inferior = 40, altura - 40, 40
-    # Ajustando a distribuição das colunas
-    if is_teacher_list:
-        col_widths = [28, 250, 228.35]  # Número, Nome do Funcionário, Assinatura
-    else:
-        col_widths = [28, 228.35, 250]  # Mantém o padrão original para alunos
-    row_height, font_size = 30, 12
+    margem_esquerda, margem_superior, margem_inferior = 40, A4[1] - 40, 40
+    row_height, font_size, tamanho_fonte_tabela = 30, 12, 9
     max_rows_per_page = 20
 
-    def desenhar_cabecalho_rodape(ultima_pagina=False):
-        c.setFont("Helvetica-Bold", font_size + 8)
-        c.setFillColor(colors.HexColor(cores["titulo"]))
-        c.drawCentredString(largura / 2, margem_superior, titulo_lista)
-        c.setFont("Helvetica-Bold", font_size)
-        c.setFillColor(colors.HexColor(cores["cabecalho"]))
-        
-        # Modificação para incluir a turma
-        cabecalho_escola = f"Escola: {escola}"
-        if not is_teacher_list and turma:
-            cabecalho_escola += f" | Turma: {turma}"
-        c.drawCentredString(largura / 2, margem_superior - 20, cabecalho_escola)
-        c.setFont("Helvetica", font_size)
-        c.setFillColor(colors.black)
-        texto_data = f"Data: {data_lista}" if data_lista else "Data: ____________"
-        c.drawString(margem_esquerda, margem_superior - 40, texto_data)
-        c.setStrokeColor(colors.HexColor(cores["linha"]))
-        c.setLineWidth(1)
-        c.line(margem_esquerda, margem_superior - 50, largura - 40, margem_superior - 50)
-        
-        if ultima_pagina:
-            c.drawString(margem_esquerda, margem_inferior + 40, f"Total de {'funcionários' if is_teacher_list else 'alunos'}: {len(items)}")
-            c.drawString(margem_esquerda, margem_inferior + 20, f"Total de {'funcionários' if is_teacher_list else 'alunos'} presentes: ________")
-            c.drawCentredString(largura / 2, margem_inferior, "SECRETARIA MUNICIPAL DE EDUCAÇÃO")
+    def __init__(self, cores, is_teacher_list):
+        self.cor_titulo = colors.HexColor(cores["titulo"])
+        self.cor_cabecalho = colors.HexColor(cores["cabecalho"])
+        self.cor_linha = colors.HexColor(cores["linha"])
+        self.cor_tabela_header = colors.HexColor(cores["tabela_header"])
+        self.cor_fundo_linhas = colors.HexColor("#ECF0F1")
+        self.is_teacher_list = is_teacher_list
+        # Ajustando a distribuição das colunas
+        if is_teacher_list:
+            self.col_widths = [28, 250, 228.35]  # Número, Nome do Funcionário, Assinatura
+        else:
+            self.col_widths = [28, 228.35, 250]  # Mantém o padrão original para alunos
+        self.col_x = [self.margem_esquerda + sum(self.col_widths[:i]) for i in range(len(self.col_widths) + 1)]
+        self.header = ["Nº", "Nome do Funcionário" if is_teacher_list else "Nome do Aluno", "Assinatura"]
+        self.topo_tabela = self.margem_superior - 70
+        # Base do texto na célula: rowpos + (bottomPadding + altura - topPadding + leading) / 2 - fontsize
+        self.ajuste_texto_cabecalho = (8 + self.row_height - 3 + 12) / 2 - self.tamanho_fonte_tabela
+        self.ajuste_texto_linha = (3 + self.row_height - 3 + 12) / 2 - self.tamanho_fonte_tabela
+
+    def base_linha(self, indice):
+        """Coordenada y da base da linha `indice` da tabela (0 = cabeçalho)"""
+        return self.topo_tabela - (indice + 1) * self.row_height
+
+@lru_cache(maxsize=None)
+def _obter_estilo_lista(cores_items, is_teacher_list):
+    return EstiloLista(dict(cores_items), is_teacher_list)
+
+def obter_estilo_lista(cores, is_teacher_list):
+    """Estilo compilado uma vez por paleta durante toda a execução"""
+    return _obter_estilo_lista(tuple(sorted(cores.items())), is_teacher_list)
+
+def _definir_form_cabecalho(c, estilo, titulo_lista, escola, turma, data_lista):
+    """Faixa de cabeçalho da lista, igual em todas as páginas do arquivo"""
+    c.beginForm("cabecalho_lista")
+    c.setFont("Helvetica-Bold", estilo.font_size + 8)
+    c.setFillColor(estilo.cor_titulo)
+    c.drawCentredString(estilo.largura / 2, estilo.margem_superior, titulo_lista)
+    c.setFont("Helvetica-Bold", estilo.font_size)
+    c.setFillColor(estilo.cor_cabecalho)
 
-    total_paginas = (len(items) + max_rows_per_page - 1) // max_rows_per_page
+    # Modificação para incluir a turma
+    cabecalho_escola = f"Escola: {escola}"
+    if not estilo.is_teacher_list and turma:
+        cabecalho_escola += f" | Turma: {turma}"
+    c.drawCentredString(estilo.largura / 2, estilo.margem_superior - 20, cabecalho_escola)
+    c.setFont("Helvetica", estilo.font_size)
+    c.setFillColor(colors.black)
+    texto_data = f"Data: {data_lista}" if data_lista else "Data: ____________"
+    c.drawString(estilo.margem_esquerda, estilo.margem_superior - 40, texto_data)
+    c.setStrokeColor(estilo.cor_linha)
+    c.setLineWidth(1)
+    c.line(estilo.margem_esquerda, estilo.margem_superior - 50, estilo.largura - 40, estilo.margem_superior - 50)
+    c.endForm()
+
+def _definir_form_grade(c, estilo, nome_form, num_linhas):
+    """Moldura da tabela (fundos, grade e cabeçalho) para `num_linhas` linhas de dados"""
+    c.beginForm(nome_form)
+    x_ini, x_fim = estilo.col_x[0], estilo.col_x[-1]
+    largura_tabela = x_fim - x_ini
+    base = estilo.base_linha(num_linhas)
+    c.setFillColor(estilo.cor_tabela_header)
+    c.rect(x_ini, estilo.base_linha(0), largura_tabela, estilo.row_height, stroke=0, fill=1)
+    if num_linhas:
+        c.setFillColor(estilo.cor_fundo_linhas)
+        c.rect(x_ini, base, largura_tabela, num_linhas * estilo.row_height, stroke=0, fill=1)
+
+    c.setFillColor(estilo.cor_titulo)
+    c.setFont("Helvetica-Bold", estilo.tamanho_fonte_tabela)
+    y_texto = estilo.base_linha(0) + estilo.ajuste_texto_cabecalho
+    for x, texto in zip(estilo.col_x, estilo.header):
+        c.drawString(x + 6, y_texto, texto)
+
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(0.25)
+    for indice in range(num_linhas + 2):
+        y = estilo.topo_tabela - indice * estilo.row_height
+        c.line(x_ini, y, x_fim, y)
+    for x in estilo.col_x:
+        c.line(x, estilo.topo_tabela, x, base)
+    c.endForm()
+
+def criar_lista_presenca(escola, nome_grupo, items, diretorio_saida, titulo_lista="Lista de Presença", cores=None, data_lista=None, is_teacher_list=False, turma=None, saida=None):
+    # Nomes extraídos uma única vez; as páginas só fatiam a lista
+    nomes = items['NOME DO FUNCIONÁRIO'].tolist() if is_teacher_list else sorted(items)
+    caminho_arquivo = os.path.join(diretorio_saida, f"lista_presenca_{nome_grupo}.pdf")
+    conteudo = io.BytesIO()
+    c = canvas.Canvas(conteudo, pagesize=A4)
+    estilo = obter_estilo_lista(cores, is_teacher_list)
+    max_rows_per_page = estilo.max_rows_per_page
+    rotulo = 'funcionários' if is_teacher_list else 'alunos'
+
+    _definir_form_cabecalho(c, estilo, titulo_lista, escola, turma, data_lista)
+    total_paginas = (len(nomes) + max_rows_per_page - 1) // max_rows_per_page
     
-    for page, start in enumerate(range(0, len(items), max_rows_per_page)):
+    for page, start in enumerate(range(0, len(nomes), max_rows_per_page)):
         if page > 0: c.showPage()
-        e_ultima_pagina = (page == total_paginas - 1)
-        desenhar_cabecalho_rodape(ultima_pagina=e_ultima_pagina)
-        
-        header = ["Nº", "Nome do Funcionário" if is_teacher_list else "Nome do Aluno", "Assinatura"]
-        if is_teacher_list:
-            dados_tabela = [header] + [[str(i + 1 + start), item['NOME DO FUNCIONÁRIO'], ""] for i, item in enumerate(items[start:start + max_rows_per_page].to_dict('records'))]
-        else:
-            dados_tabela = [header] + [[str(i + 1 + start), item, ""] for i, item in enumerate(items[start:start + max_rows_per_page])]
-            
-        table = Table(dados_tabela, colWidths=col_widths, rowHeights=row_height)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(cores["tabela_header"])),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor(cores["titulo"])),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#ECF0F1")),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('GRID', (0, 0), (-1, -1), 0.25, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        altura_tabela = margem_superior - 70
-        table.wrapOn(c, largura, altura)
-        table.drawOn(c, margem_esquerda, altura_tabela - len(dados_tabela) * row_height)
+        nomes_pagina = nomes[start:start + max_rows_per_page]
+        c.doForm("cabecalho_lista")
+
+        # A moldura só é desenhada uma vez por quantidade de linhas (em geral, 20 e a da última página)
+        nome_form = f"grade_lista_{len(nomes_pagina)}"
+        if not c.hasForm(nome_form):
+            _definir_form_grade(c, estilo, nome_form, len(nomes_pagina))
+        c.doForm(nome_form)
+
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica", estilo.tamanho_fonte_tabela)
+        for i, nome in enumerate(nomes_pagina, start=1):
+            y_texto = estilo.base_linha(i) + estilo.ajuste_texto_linha
+            c.drawString(estilo.col_x[0] + 6, y_texto, str(i + start))
+            c.drawString(estilo.col_x[1] + 6, y_texto, str(nome))
+
+        if page == total_paginas - 1:
+            c.setFont("Helvetica", estilo.font_size)
+            c.drawString(estilo.margem_esquerda, estilo.margem_inferior + 40, f"Total de {rotulo}: {len(nomes)}")
+            c.drawString(estilo.margem_esquerda, estilo.margem_inferior + 20, f"Total de {rotulo} presentes: ________")
+            c.drawCentredString(estilo.largura / 2, estilo.margem_inferior, "SECRETARIA MUNICIPAL DE EDUCAÇÃO")
     c.save()
+    with (saida.abrir(caminho_arquivo) if saida else escrita_atomica(caminho_arquivo)) as f:
+        f.write(conteudo.getvalue())
     print(f"Lista de presença salva: {caminho_arquivo}")
 
-def criar_gabaritos(csv_path, modelo_path, output_dir, config, etapas_selecionadas, escolas_selecionadas):
+# Layout declarativo do gabarito desenhado direto em PDF (ver RenderizadorGabaritoPDF)
+LAYOUT_GABARITO_PADRAO = {
+    "titulo": "GABARITO",
+    # (rótulo, placeholder) de cada campo do cabeçalho, na ordem em que aparecem
+    "campos": [
+        ("Escola", "$VARIÁVEL ESCOLA"),
+        ("Turma", "$VARIÁVEL TURMA"),
+        ("Professor(a)", "$VARIÁVEL PROFESSOR REGENTE"),
+        ("Aluno(a)", "$VARIÁVEL NOME DO ALUNO"),
+    ],
+    # Placeholder do nome do aluno de cada folha da página (modo "dois_alunos")
+    "chaves_aluno": ["$VARIÁVEL NOME DO ALUNO", "$VARIÁVEL NOME DO ALUNO 2"],
+    "num_questoes": 20,
+    "alternativas": "ABCDE",
+    "colunas": 2,
+    "raio_bolha": 6,
+    "margem": 28,
+    "tamanho_marca": 10,  # quadrados de referência nos cantos, usados na leitura óptica
+}
+
+class RenderizadorGabaritoPDF:
+    """
+    Desenha o gabarito direto em PDF a partir de um layout declarativo, sem passar pelo Word.
+    Tudo o que é fixo (marcas, título, rótulos e grade de bolhas) é desenhado uma vez por arquivo
+    como form XObject e reaproveitado; cada folha só escreve os dados do aluno.
+    Mesma interface do ModeloCompilado: preencher, salvar e novo_agregado.
+    """
+    extensao = ".pdf"
+    NOME_FORM = "fundo_gabarito"
+    RAIO_MINIMO_BOLHA = 3  # pt; menor que isso a bolha não é legível nem para preencher nem para a leitura óptica
+    FOLGA_BOLHA = 2  # pt entre as bolhas de linhas vizinhas
+
+    def __init__(self, layout=None, folhas_por_pagina=1, cores=None):
+        self.layout = {**LAYOUT_GABARITO_PADRAO, **(layout or {})}
+        self.folhas_por_pagina = folhas_por_pagina
+        self.cor_titulo = colors.HexColor((cores or {}).get("titulo", "#000000"))
+        self.largura, self.altura_pagina = A4
+        self.altura_folha = self.altura_pagina / folhas_por_pagina
+        self.dados = {}
+        self.impressao = impressao_digital(self.layout, cores, folhas_por_pagina)
+
+        # Geometria calculada uma única vez, em coordenadas da folha
+        layout = self.layout
+        margem = layout["margem"]
+        topo = self.altura_folha - margem - layout["tamanho_marca"]
+        self.y_titulo = topo - 8
+        self.x_rotulo = margem + 20
+        self.x_valor = self.x_rotulo + 75
+        self.x_fim_linha = self.largura - margem - 20
+        self.y_campos = [self.y_titulo - 24 - i * 16 for i in range(len(layout["campos"]))]
+
+        base_grade = margem + layout["tamanho_marca"] + 8
+        topo_grade = (self.y_campos[-1] if self.y_campos else self.y_titulo) - 26
+        colunas = max(1, layout["colunas"])
+        self.linhas_por_coluna = -(-layout["num_questoes"] // colunas)
+        self.passo_linha = min(3 * layout["raio_bolha"] + 4,
+                               (topo_grade - base_grade) / max(1, self.linhas_por_coluna))
+        # Com muitas questões (ou duas folhas por página) as linhas ficam mais juntas: a bolha diminui
+        # junto, para não encostar na da linha de baixo, até o limite do legível
+        self.raio_bolha = min(layout["raio_bolha"], (self.passo_linha - self.FOLGA_BOLHA) / 2)
+        if self.raio_bolha < self.RAIO_MINIMO_BOLHA:
+            espaco = "uma página" if folhas_por_pagina == 1 else "meia página (dois alunos por folha)"
+            raise ValueError(
+                f"O gabarito com {layout['num_questoes']} questões em {colunas} coluna(s) não cabe em {espaco}: "
+                f"as bolhas ficariam sobrepostas. Use mais colunas no layout"
+                + (" ou um aluno por folha" if folhas_por_pagina > 1 else ""))
+        self.passo_bolha = 2 * self.raio_bolha + 6
+        self.largura_coluna = (self.largura - 2 * margem - 40) / colunas
+        self.topo_grade = topo_grade
+
+    def _centro_bolha(self, questao, alternativa):
+        coluna, linha = divmod(questao, self.linhas_por_coluna)
+        x = self.layout["margem"] + 20 + coluna * self.largura_coluna + 30 + alternativa * self.passo_bolha
+        y = self.topo_grade - (linha + 0.5) * self.passo_linha
+        return x, y
+
+    def _definir_fundo(self, c):
+        layout = self.layout
+        margem, marca = layout["margem"], layout["tamanho_marca"]
+        c.beginForm(self.NOME_FORM)
+        c.setFillColor(colors.black)
+        for x in (margem, self.largura - margem - marca):
+            for y in (margem, self.altura_folha - margem - marca):
+                c.rect(x, y, marca, marca, stroke=0, fill=1)
+
+        c.setFillColor(self.cor_titulo)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawCentredString(self.largura / 2, self.y_titulo, layout["titulo"])
+
+        c.setFillColor(colors.black)
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(0.5)
+        c.setFont("Helvetica-Bold", 9)
+        for (rotulo, _), y in zip(layout["campos"], self.y_campos):
+            c.drawString(self.x_rotulo, y, f"{rotulo}:")
+            c.line(self.x_valor - 2, y - 2, self.x_fim_linha, y - 2)
+
+        raio = self.raio_bolha
+        # Número da questão e letras acompanham o tamanho da bolha (8 e 6 pt no tamanho do layout)
+        fonte_numero = min(8, self.passo_linha - self.FOLGA_BOLHA)
+        fonte_letra = 6 * raio / layout["raio_bolha"]
+        for questao in range(layout["num_questoes"]):
+            x, y = self._centro_bolha(questao, 0)
+            c.setFont("Helvetica-Bold", fonte_numero)
+            c.drawRightString(x - raio - 6, y - fonte_numero * 0.375, str(questao + 1))
+            c.setFont("Helvetica", fonte_letra)
+            for i, letra in enumerate(layout["alternativas"]):
+                x, y = self._centro_bolha(questao, i)
+                c.circle(x, y, raio, stroke=1, fill=0)
+                c.drawCentredString(x, y - fonte_letra / 3, letra)
+        c.endForm()
+
+    def _dados_da_folha(self, dados, indice):
+        chaves_aluno = self.layout["chaves_aluno"]
+        if indice == 0:
+            return dados
+        chave = chaves_aluno[indice] if indice < len(chaves_aluno) else None
+        if not chave or not dados.get(chave):
+            return None
+        return {**dados, chaves_aluno[0]: dados[chave]}
+
+    def desenhar_pagina(self, c, dados):
+        """Desenha uma página (uma ou duas folhas) no canvas informado"""
+        if not c.hasForm(self.NOME_FORM):
+            self._definir_fundo(c)
+        for indice in range(self.folhas_por_pagina):
+            dados_folha = self._dados_da_folha(dados, indice)
+            if dados_folha is None:
+                continue
+            c.saveState()
+            c.translate(0, self.altura_pagina - (indice + 1) * self.altura_folha)
+            c.doForm(self.NOME_FORM)
+            c.setFont("Helvetica", 10)
+            for (_, chave), y in zip(self.layout["campos"], self.y_campos):
+                c.drawString(self.x_valor, y, str(dados_folha.get(chave, "")))
+            c.restoreState()
+        c.showPage()
+
+    def preencher(self, dados):
+        self.dados = dados
+        return self
+
+    def novo_agregado(self):
+        return DocumentoPDFAgregado(self)
+
+    def salvar(self, destino):
+        """Salva a página com os dados atuais (caminho ou objeto de arquivo)"""
+        if not hasattr(destino, 'write'):
+            with escrita_atomica(destino) as f:
+                return self.salvar(f)
+        c = canvas.Canvas(destino, pagesize=A4)
+        self.desenhar_pagina(c, self.dados)
+        c.save()
+
+class DocumentoPDFAgregado:
+    """Várias páginas de gabarito em um único PDF, compartilhando o mesmo fundo"""
+    def __init__(self, renderizador):
+        self.renderizador = renderizador
+        self._buffer = io.BytesIO()
+        self._canvas = canvas.Canvas(self._buffer, pagesize=A4)
+        self.total = 0
+
+    def adicionar(self):
+        self.renderizador.desenhar_pagina(self._canvas, self.renderizador.dados)
+        self.total += 1
+
+    def salvar(self, destino):
+        self._canvas.save()
+        if hasattr(destino, 'write'):
+            destino.write(self._buffer.getvalue())
+        else:
+            with escrita_atomica(destino) as f:
+                f.write(self._buffer.getvalue())
+
+# Modelos já preparados neste processo, reaproveitados entre execuções (ex.: jobs de um manifesto)
+_modelos_carregados = {}
+
+def carregar_modelo(modelo_path, config):
+    """Prepara o gerador de gabaritos da execução: modelo Word compilado ou renderizador PDF"""
+    if config.formato_gabarito == "pdf":
+        folhas_por_pagina = 1 if config.process_mode == "um_aluno" else 2
+        chave = ("pdf", json.dumps([config.layout_gabarito, config.cores], sort_keys=True), folhas_por_pagina)
+        if chave not in _modelos_carregados:
+            _modelos_carregados[chave] = RenderizadorGabaritoPDF(config.layout_gabarito, folhas_por_pagina, config.cores)
+        return _modelos_carregados[chave]
+
+    # O mtime entra na chave para que um modelo alterado no disco seja lido de novo
+    chave = ("docx", os.path.abspath(modelo_path), os.stat(modelo_path).st_mtime_ns, config.nivel_compressao)
+    if chave not in _modelos_carregados:
+        _modelos_carregados[chave] = ModeloCompilado(modelo_path, nivel_compressao=config.nivel_compressao)
+    return _modelos_carregados[chave]
+
+# Paletas de cores pasteis pré-definidas
+PALETAS_CORES = {
+    "Verde Suave": {
+        "titulo": "#2C3E50",
+        "cabecalho": "#34495E",
+        "linha": "#3ddb65",
+        "tabela_header": "#98FB98"
+    },
+    "Rosa Delicado": {
+        "titulo": "#4A4A4A",
+        "cabecalho": "#5D4E6D",
+        "linha": "#FFB6C1",
+        "tabela_header": "#FFC0CB"
+    },
+    "Azul Sereno": {
+        "titulo": "#2C3E50",
+        "cabecalho": "#34495E",
+        "linha": "#87CEEB",
+        "tabela_header": "#ADD8E6"
+    },
+    "Lilás Suave": {
+        "titulo": "#4A4A4A",
+        "cabecalho": "#5D4E6D",
+        "linha": "#DDA0DD",
+        "tabela_header": "#E6E6FA"
+    },
+    "Marrom Café": {
+        "titulo": "#3E2723",
+        "cabecalho": "#4E342E",
+        "linha": "#8D6E63",
+        "tabela_header": "#D7CCC8"
+    },
+    "Cinza Elegante": {
+        "titulo": "#263238",
+        "cabecalho": "#37474F",
+        "linha": "#78909C",
+        "tabela_header": "#CFD8DC"
+    },
+    "Verde Menta": {
+        "titulo": "#004D40",
+        "cabecalho": "#00695C",
+        "linha": "#4DB6AC",
+        "tabela_header": "#B2DFDB"
+    },
+    "Roxo Real": {
+        "titulo": "#311B92",
+        "cabecalho": "#4527A0",
+        "linha": "#7E57C2",
+        "tabela_header": "#D1C4E9"
+    },
+    "Laranja Solar": {
+        "titulo": "#E65100",
+        "cabecalho": "#EF6C00",
+        "linha": "#FFB74D",
+        "tabela_header": "#FFE0B2"
+    },
+    "Azul Corporativo": {
+        "titulo": "#0D47A1",
+        "cabecalho": "#1565C0",
+        "linha": "#42A5F5",
+        "tabela_header": "#BBDEFB"
+    }
+}
+
+class UnidadeTrabalho:
+    """Unidade de geração independente: uma turma de uma escola (ou a escola inteira, para funcionários)"""
+    def __init__(self, escola, turma=None, alunos=None, professor_regente='', funcionarios=None, registros=0,
+                 alunos_sanitizados=None, pasta_escola=None, pasta_turma=None):
+        self.escola = escola
+        self.turma = turma
+        self.alunos = alunos or []
+        # Nomes dos alunos já prontos para nomes de arquivo (sanitizar_nomes), na mesma ordem
+        self.alunos_sanitizados = alunos_sanitizados
+        self.professor_regente = professor_regente
+        self.funcionarios = funcionarios
+        self.registros = registros  # Linhas do CSV que deram origem à unidade (para o progresso)
+        # Pastas de saída da escola e da turma; montar_unidades as torna únicas (PastasSaida)
+        self.pasta_escola = pasta_escola or sanitizar_nome(escola)
+        if pasta_turma is None and turma is not None:
+            pasta_turma = sanitizar_nome(turma)
+        self.pasta_turma = pasta_turma
+
+class RelatorioExecucao:
+    """Totais de uma execução, mesclável entre unidades e processos"""
+    def __init__(self):
+        self.registros = 0
+        self.gabaritos = 0
+        self.listas = 0
+        self.erros = []  # (escola, turma, mensagem)
+        # Regeneração incremental
+        self.ignorados = 0  # Arquivos já atualizados, não gerados de novo
+        self.removidos = 0  # Arquivos desatualizados apagados
+        self.arquivos = {}  # Caminho relativo -> impressão digital das saídas desta execução
+        self.diretorios = set()  # Pastas (relativas) abrangidas por esta execução
+        # Instrumentação
+        self.documentos = 0  # Arquivos gravados
+        self.bytes_gravados = 0
+        # Caminho -> (contador, quantidade) que o arquivo somou em gabaritos/listas; usado em processar_lote
+        # para descontar as falhas de gravação em segundo plano
+        self.contagens = {}
+        self.etapas = {}  # Etapa -> [quantidade, segundos, pico de memória residente em MB]
+        self.cancelado = False  # Interrompido pelo usuário (os arquivos já gravados ficam completos)
+        self.limite_memoria = None  # Mensagem, se o processo passou de Configuracao.limite_memoria_mb
+
+    def mesclar(self, outro):
+        self.gabaritos += outro.gabaritos
+        self.listas += outro.listas
+        self.erros.extend(outro.erros)
+        self.ignorados += outro.ignorados
+        self.arquivos.update(outro.arquivos)
+        self.diretorios.update(outro.diretorios)
+        self.documentos += outro.documentos
+        self.bytes_gravados += outro.bytes_gravados
+        self.contagens.update(outro.contagens)
+        self.cancelado = self.cancelado or outro.cancelado
+        self.limite_memoria = self.limite_memoria or outro.limite_memoria
+        for etapa, (quantidade, segundos, pico) in outro.etapas.items():
+            acumulado = self.etapas.setdefault(etapa, [0, 0.0, 0.0])
+            acumulado[0] += quantidade
+            acumulado[1] += segundos
+            acumulado[2] = max(acumulado[2], pico)  # Processos diferentes: vale o maior pico
+        return self
+
+    def cronometrar(self, etapa):
+        """Soma o tempo do bloco `with` na etapa indicada"""
+        return Cronometro(self.etapas, etapa)
+
+    def mensagem(self):
+        if not self.registros:
+            return "Nenhum registro encontrado para as escolas/etapas selecionadas."
+        if self.cancelado and not self.erros:
+            return f"Geração cancelada: {self.documentos} arquivo(s) gerado(s) antes da interrupção."
+        if not self.erros:
+            if self.ignorados or self.removidos:
+                return (f"Documentos gerados com sucesso! ({self.ignorados} já atualizado(s), "
+                        f"{self.removidos} removido(s))")
+            return "Documentos gerados com sucesso!"
+        detalhes = "\n".join(f"{escola or '-'} / {turma or '-'}: {erro}" for escola, turma, erro in self.erros)
+        return f"{len(self.erros)} unidade(s) com erro:\n{detalhes}"
+
+    @classmethod
+    def de_dict(cls, dados):
+        """Relatório a partir de como_dict() (ex.: o relatório de uma partição gravado em disco)"""
+        relatorio = cls()
+        for campo in ('registros', 'gabaritos', 'listas', 'ignorados', 'removidos', 'documentos',
+                      'bytes_gravados', 'cancelado'):
+            setattr(relatorio, campo, dados[campo])
+        relatorio.etapas = {etapa: [totais['quantidade'], totais['total_s'], totais['pico_memoria_mb']]
+                            for etapa, totais in dados['etapas'].items()}
+        relatorio.erros = [(erro['escola'], erro['turma'], erro['erro']) for erro in dados['erros']]
+        return relatorio
+
+    def como_dict(self):
+        return {
+            'registros': self.registros,
+            'gabaritos': self.gabaritos,
+            'listas': self.listas,
+            'ignorados': self.ignorados,
+            'removidos': self.removidos,
+            'documentos': self.documentos,
+            'bytes_gravados': self.bytes_gravados,
+            'cancelado': self.cancelado,
+            'pico_memoria_mb': round(max((pico for _, _, pico in self.etapas.values()), default=0.0), 1),
+            'etapas': {etapa: {'quantidade': quantidade, 'total_s': round(segundos, 4),
+                               'pico_memoria_mb': round(pico, 1)}
+                       for etapa, (quantidade, segundos, pico) in self.etapas.items()},
+            'erros': [{'escola': escola, 'turma': turma, 'erro': erro} for escola, turma, erro in self.erros],
+        }
+
+# Leitor da memória residente de cada processo (após um fork, o herdado mediria o processo pai)
+_leitor_memoria = {}
+
+def _abrir_leitor_memoria():
     try:
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8', dtype=str)
-        csv_format = detect_csv_format(df)
-        
-        if csv_format == "professor_format":
-            df = df.rename(columns={'ETAPA': 'ETAPA DE ENSINO', 'NOME DA ESCOLA': 'ESCOLA'})
-        
-        if escolas_selecionadas is None:
-            escolas_selecionadas = df['ESCOLA'].dropna().unique()
-        
-        mask_escolas = df['ESCOLA'].fillna('').isin(escolas_selecionadas)
-        
-        if etapas_selecionadas:
-            mask_etapas = df['ETAPA DE ENSINO'].fillna('').isin(etapas_selecionadas)
-            df_filtrado = df[mask_escolas & mask_etapas].copy()
+        descritor = os.open('/proc/self/statm', os.O_RDONLY)
+        pagina = os.sysconf('SC_PAGE_SIZE')
+    except (OSError, AttributeError, ValueError):
+        try:
+            import psutil
+        except ImportError:
+            return None  # Sem /proc nem psutil: a memória não é medida
+        processo = psutil.Process()
+        return lambda: processo.memory_info().rss
+
+    def ler():
+        return int(os.pread(descritor, 64, 0).split()[1]) * pagina
+    return ler
+
+def memoria_residente_mb():
+    """Memória residente (RSS) atual do processo em MB, ou None se não houver como medir"""
+    pid = os.getpid()
+    if pid not in _leitor_memoria:
+        _leitor_memoria.clear()
+        _leitor_memoria[pid] = _abrir_leitor_memoria()
+    leitor = _leitor_memoria[pid]
+    return leitor() / 1024 / 1024 if leitor else None
+
+def liberar_memoria():
+    """Descarta os caches refeitos sob demanda e devolve ao sistema a memória já liberada"""
+    obter_substituidor.cache_clear()
+    _obter_estilo_lista.cache_clear()
+    sanitizar_nome.cache_clear()
+    _indices_csv.clear()
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)  # glibc guarda a memória liberada para reutilizar
+    except (OSError, AttributeError):
+        pass
+
+def verificar_limite_memoria(config):
+    """
+    Mensagem de erro se o processo passou de config.limite_memoria_mb mesmo depois de liberar
+    os caches; None se está dentro do limite (ou se não há limite ou medição).
+    """
+    limite = config.limite_memoria_mb
+    if not limite:
+        return None
+    memoria = memoria_residente_mb()
+    if memoria is None or memoria <= limite:
+        return None
+    liberar_memoria()
+    memoria = memoria_residente_mb()
+    if memoria <= limite:
+        return None
+    return f"Limite de memória de {limite:.0f} MB excedido ({memoria:.0f} MB no processo {os.getpid()})"
+
+class Cronometro:
+    """
+    Context manager que acumula quantidade e tempo de uma etapa em um dicionário de etapas,
+    junto com a maior memória residente vista no fim da etapa
+    """
+    def __init__(self, etapas, etapa):
+        self.etapas = etapas
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        acumulado = self.etapas.setdefault(self.etapa, [0, 0.0, 0.0])
+        acumulado[0] += 1
+        acumulado[1] += time.perf_counter() - self.inicio
+        memoria = memoria_residente_mb()
+        if memoria is not None and memoria > acumulado[2]:
+            acumulado[2] = memoria
+
+class Instrumentacao:
+    """
+    Acompanhamento de uma execução: envia eventos (dicionários com a chave 'tipo') aos coletores.
+    Coletores são funções que recebem o evento, como ColetorBarraProgresso e ColetorJsonl; a interface
+    gráfica pode passar a sua própria. Os tempos por etapa ficam no RelatorioExecucao, que também
+    volta dos processos do pool; o progresso é emitido no processo principal a cada lote concluído.
+    `perfil` ("cprofile" ou "tracemalloc") captura um perfil do processo principal para diagnóstico.
+    """
+    def __init__(self, coletores=(), perfil=None, arquivo_perfil=None, job=None):
+        self.coletores = list(coletores)
+        self.perfil = perfil
+        self.arquivo_perfil = arquivo_perfil  # .prof (cProfile) ou snapshot do tracemalloc
+        self.job = job
+        self.inicio = time.perf_counter()
+        self.registros_total = 0
+        self.registros_processados = 0
+        self.documentos = 0
+        self.bytes_gravados = 0
+        self.documentos_por_escola = {}
+
+    def emitir(self, tipo, **dados):
+        if not self.coletores:
+            return
+        evento = {'tipo': tipo, 'decorrido_s': round(time.perf_counter() - self.inicio, 3), **dados}
+        if self.job is not None:
+            evento['job'] = self.job
+        for coletor in self.coletores:
+            coletor(evento)
+
+    def iniciar(self, registros_total):
+        self.registros_total = registros_total
+        self.emitir('inicio', registros_total=registros_total)
+
+    def lote_concluido(self, lote, relatorio):
+        """Atualiza os totais com o relatório de um lote e emite o evento de progresso"""
+        self.registros_processados += sum(unidade.registros for unidade in lote)
+        self.documentos += relatorio.documentos
+        self.bytes_gravados += relatorio.bytes_gravados
+        escola = lote[0].escola
+        self.documentos_por_escola[escola] = self.documentos_por_escola.get(escola, 0) + relatorio.documentos
+
+        fracao = self.registros_processados / self.registros_total if self.registros_total else 1.0
+        decorrido = time.perf_counter() - self.inicio
+        self.emitir('progresso',
+                    escola=escola,
+                    turma=lote[0].turma if len(lote) == 1 else None,
+                    registros_processados=self.registros_processados,
+                    registros_total=self.registros_total,
+                    percentual=round(100 * fracao, 1),
+                    documentos=self.documentos,
+                    documentos_escola=self.documentos_por_escola[escola],
+                    bytes_gravados=self.bytes_gravados,
+                    eta_s=round(decorrido * (1 - fracao) / fracao, 1) if fracao else None,
+                    erros=len(relatorio.erros))
+
+    @contextmanager
+    def sessao(self, relatorio):
+        """Delimita a execução: liga o perfil (se pedido) e emite o evento 'fim' com o relatório"""
+        self.inicio = time.perf_counter()
+        perfilador = None
+        if self.perfil == "cprofile":
+            import cProfile
+            perfilador = cProfile.Profile()
+            perfilador.enable()
+        elif self.perfil == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start(10)
+        try:
+            yield self
+        finally:
+            resumo_perfil = None
+            if perfilador is not None:
+                import pstats
+                perfilador.disable()
+                texto = io.StringIO()
+                pstats.Stats(perfilador, stream=texto).sort_stats('cumulative').print_stats(25)
+                resumo_perfil = texto.getvalue()
+                if self.arquivo_perfil:
+                    perfilador.dump_stats(self.arquivo_perfil)
+            elif self.perfil == "tracemalloc":
+                foto = tracemalloc.take_snapshot()
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                linhas = [f"Pico de memória alocada: {pico / 1024 / 1024:.1f} MB"]
+                linhas += [str(estatistica) for estatistica in foto.statistics('lineno')[:25]]
+                resumo_perfil = "\n".join(linhas)
+                if self.arquivo_perfil:
+                    foto.dump(self.arquivo_perfil)
+            self.emitir('fim', **relatorio.como_dict())
+            if resumo_perfil is not None:
+                self.emitir('perfil', modo=self.perfil, resumo=resumo_perfil)
+
+def formatar_duracao(segundos):
+    """mm:ss (ou --:-- quando ainda não há estimativa)"""
+    if segundos is None:
+        return "--:--"
+    return f"{int(segundos // 60):02d}:{int(segundos % 60):02d}"
+
+class ColetorBarraProgresso:
+    """Barra de progresso no console (stderr), com o resumo das etapas no fim"""
+    def __init__(self, saida=None, largura=30):
+        self.saida = saida or sys.stderr
+        self.largura = largura
+
+    def __call__(self, evento):
+        if evento['tipo'] == 'progresso':
+            cheios = int(self.largura * evento['percentual'] / 100)
+            self.saida.write(f"\r[{'#' * cheios}{'.' * (self.largura - cheios)}] {evento['percentual']:5.1f}% "
+                             f"{evento['registros_processados']}/{evento['registros_total']} registros | "
+                             f"{evento['documentos']} documentos | ETA {formatar_duracao(evento['eta_s'])}")
+            self.saida.flush()
+        elif evento['tipo'] == 'fim':
+            self.saida.write(f"\nConcluído em {evento['decorrido_s']:.1f}s: {evento['documentos']} documentos, "
+                             f"{evento['bytes_gravados'] / 1024 / 1024:.1f} MB, "
+                             f"pico de memória por processo {evento['pico_memoria_mb']:.0f} MB\n")
+            for etapa, totais in sorted(evento['etapas'].items(), key=lambda item: -item[1]['total_s']):
+                media_ms = 1000 * totais['total_s'] / totais['quantidade']
+                self.saida.write(f"  {etapa:<20}{totais['quantidade']:>8}x {totais['total_s']:>9.3f}s "
+                                 f"{media_ms:>9.3f} ms/op {totais['pico_memoria_mb']:>8.0f} MB\n")
+        elif evento['tipo'] == 'perfil':
+            self.saida.write(f"\nPerfil ({evento['modo']}):\n{evento['resumo']}\n")
+
+class ColetorJsonl:
+    """Grava cada evento como uma linha JSON (o arquivo é aberto em modo de acréscimo)"""
+    def __init__(self, caminho):
+        self.arquivo = open(caminho, 'a', encoding='utf-8')
+
+    def __call__(self, evento):
+        self.arquivo.write(json.dumps(evento, ensure_ascii=False) + "\n")
+        self.arquivo.flush()
+
+    def fechar(self):
+        self.arquivo.close()
+
+class IndiceRegistros:
+    """
+    Agrupamento dos registros filtrados feito uma única vez por execução, pelos códigos das colunas:
+    escola -> turma -> posições das linhas (escolas na ordem do arquivo, turmas em ordem alfabética,
+    alunos na ordem do arquivo) e, para as listas de funcionários, o quadro de cada escola já sem repetições.
+    """
+    def __init__(self, df, por_funcionarios=False):
+        # O DataFrame não fica guardado: depois de indexado, pode ser liberado
+        codigos_escola, self.escolas = pd.factorize(df['ESCOLA'])  # Códigos na ordem de aparição
+        self.codigos_escola = codigos_escola
+        if por_funcionarios:
+            self.funcionarios = self._indexar_funcionarios(df)
+        else:
+            self.grupos = self._indexar_turmas(df)
+
+    def _indexar_turmas(self, df):
+        turmas = pd.Categorical(df['TURMA'])  # Categorias ordenadas, como no groupby
+        codigos_turma = np.asarray(turmas.codes)
+        # lexsort é estável: dentro de cada turma as linhas mantêm a ordem do arquivo
+        ordem = np.lexsort((codigos_turma, self.codigos_escola))
+        ordem = ordem[(self.codigos_escola[ordem] >= 0) & (codigos_turma[ordem] >= 0)]  # Sem escola/turma vazia
+        if not len(ordem):
+            return []
+        escolas, turmas_ordenadas = self.codigos_escola[ordem], codigos_turma[ordem]
+        quebras = np.flatnonzero((escolas[1:] != escolas[:-1]) | (turmas_ordenadas[1:] != turmas_ordenadas[:-1])) + 1
+        inicios, fins = np.r_[0, quebras], np.r_[quebras, len(ordem)]
+        return [(self.escolas[escolas[inicio]], turmas.categories[turmas_ordenadas[inicio]], ordem[inicio:fim])
+                for inicio, fim in zip(inicios, fins)]
+
+    def _indexar_funcionarios(self, df):
+        registros = np.bincount(self.codigos_escola[self.codigos_escola >= 0], minlength=len(self.escolas))
+        quadros = {escola: quadro.drop(columns='ESCOLA')
+                   for escola, quadro in get_unique_teachers(df, por_escola=True)
+                   .groupby('ESCOLA', sort=False, observed=True)}
+        return [(escola, quadros[escola], int(registros[codigo]))
+                for codigo, escola in enumerate(self.escolas) if escola in quadros]
+
+    def turmas(self):
+        """(escola, turma, posições das linhas) de cada turma"""
+        return iter(self.grupos)
+
+    def funcionarios_por_escola(self):
+        """(escola, funcionários sem repetição, quantidade de registros) de cada escola"""
+        return iter(self.funcionarios)
+
+def montar_unidades(df_filtrado, config, pares=None):
+    """
+    Gera, em sequência, as unidades de trabalho (escola, turma) a partir do IndiceRegistros.
+    Só o índice e as colunas usadas ficam com o gerador: o DataFrame pode ser liberado em seguida.
+    `pares` são os pares (escola, turma) do arquivo inteiro (carregar_registros); sem eles, as
+    pastas são decididas só com os registros recebidos.
+    """
+    pastas = PastasSaida(pares if pares is not None else pares_escola_turma(df_filtrado))
+    indice = IndiceRegistros(df_filtrado, por_funcionarios=config.is_teacher_list)
+    if config.is_teacher_list:
+        return (UnidadeTrabalho(escola, funcionarios=funcionarios, registros=registros,
+                                pasta_escola=pastas.escolas[escola])
+                for escola, funcionarios, registros in indice.funcionarios_por_escola())
+    nomes = df_filtrado['NOME DO ALUNO'].to_numpy()
+    return _unidades_das_turmas(indice, nomes, sanitizar_nomes(nomes), df_filtrado['PROFESSOR REGENTE'].to_numpy(),
+                                pastas)
+
+def _nome_turma(turma):
+    # Remove os parênteses e vírgula do nome da turma
+    return str(turma).strip("(),'")  # Remove (, ), e vírgula
+
+class PastasSaida:
+    """
+    Pastas de saída de todas as escolas e turmas do arquivo. Escolas (ou turmas da mesma escola)
+    diferentes cujos nomes ficam iguais depois de sanitizados ("T1" e "T1 ", "T/3" e "T_3") ganham
+    pastas distintas (NomesUnicos), em vez de uma sobrescrever os arquivos da outra.
+    Os nomes são decididos com o arquivo inteiro e numa ordem que não depende da seleção (primeiro
+    os nomes que a sanitização não altera, depois os demais em ordem alfabética): a mesma escola vai
+    sempre para a mesma pasta, em qualquer execução, lote, processo ou partição.
+    """
+    def __init__(self, pares):
+        pares = [(escola, turma) for escola, turma in pares if not pd.isna(escola)]
+        self.escolas = self._resolver({escola: sanitizar_nome(escola) for escola, _ in pares})
+        turmas_por_escola = {}
+        for escola, turma in pares:
+            if not pd.isna(turma):
+                turmas_por_escola.setdefault(escola, {})[turma] = sanitizar_nome(_nome_turma(turma))
+        self.turmas = {(escola, turma): pasta
+                       for escola, turmas in turmas_por_escola.items()
+                       for turma, pasta in self._resolver(turmas).items()}
+
+    @staticmethod
+    def _resolver(sanitizados):
+        """Nome original -> pasta única, a partir de {nome original: nome sanitizado}"""
+        pasta_unica = NomesUnicos()
+        ordem = sorted(sanitizados, key=lambda nome: (sanitizados[nome] != nome, str(nome)))
+        return {nome: pasta_unica(sanitizados[nome]) for nome in ordem}
+
+def _unidades_das_turmas(indice, nomes, nomes_sanitizados, professores, pastas):
+    for escola, turma, posicoes in indice.turmas():
+        pasta_turma = pastas.turmas[escola, turma]
+        turma = _nome_turma(turma)
+        # Fix professor handling - replace NaN with empty string
+        professor_regente = professores[posicoes[0]]
+        professor_regente = '' if pd.isna(professor_regente) else professor_regente
+        yield UnidadeTrabalho(escola, turma, nomes[posicoes].tolist(), professor_regente,
+                              registros=len(posicoes), alunos_sanitizados=nomes_sanitizados[posicoes].tolist(),
+                              pasta_escola=pastas.escolas[escola], pasta_turma=pasta_turma)
+
+def folhas_da_unidade(unidade, config):
+    """
+    Gera (dados, nome do arquivo sem extensão) de cada folha de gabarito da turma, conforme o modo de geração.
+    Os nomes vêm de UnidadeTrabalho.alunos_sanitizados e não se repetem dentro da turma (NomesUnicos).
+    """
+    escola, turma, alunos = unidade.escola, unidade.turma, unidade.alunos
+    professor_regente = unidade.professor_regente
+    sanitizados = unidade.alunos_sanitizados
+    if sanitizados is None:
+        sanitizados = sanitizar_nomes(alunos).tolist()
+    nome_unico = NomesUnicos()
+    if config.process_mode == "um_aluno":
+        for aluno, aluno_sanitizado in zip(alunos, sanitizados):
+            dados_aluno = {
+                '$VARIÁVEL ESCOLA': escola,
+                '$VARIÁVEL TURMA': turma,  # Usando a turma já limpa
+                '$VARIÁVEL PROFESSOR REGENTE': professor_regente,
+                '$VARIÁVEL NOME DO ALUNO': aluno,
+                '$VARIÁVEL NOME DO ALUNO 2': ''
+            }
+            yield dados_aluno, nome_unico(f"{aluno_sanitizado}_gabarito")
+    else:
+        for i in range(0, len(alunos), 2):
+            aluno1 = alunos[i]
+            aluno2 = alunos[i + 1] if (i + 1) < len(alunos) else None
+            dados_alunos = {
+                '$VARIÁVEL ESCOLA': escola,
+                '$VARIÁVEL TURMA': turma,
+                '$VARIÁVEL PROFESSOR REGENTE': professor_regente,
+                '$VARIÁVEL NOME DO ALUNO': aluno1,
+                '$VARIÁVEL NOME DO ALUNO 2': aluno2 if aluno2 else ''
+            }
+            if aluno2:
+                nome_arquivo = f"{sanitizados[i]}_e_{sanitizados[i + 1]}_gabarito"
+            else:
+                nome_arquivo = f"{sanitizados[i]}_gabarito"
+            yield dados_alunos, nome_unico(nome_arquivo)
+
+def impressao_digital(*partes):
+    """Resumo (SHA-1) das partes, estável entre execuções; usado para detectar saídas desatualizadas"""
+    conteudo = json.dumps(partes, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+# Opções da Configuracao que mudam o conteúdo ou o nome dos arquivos gerados
+CAMPOS_IMPRESSAO_CONFIG = ('process_mode', 'titulo_lista', 'data_lista', 'cores', 'nivel_compressao',
+                           'agrupamento_gabaritos', 'formato_gabarito', 'layout_gabarito')
+
+def tipo_da_saida(relativo):
+    """
+    Tipo de um arquivo gerado, pelo caminho relativo: 'funcionarios' (ESCOLA/lista_presenca_funcionarios.pdf),
+    'listas' (ESCOLA/TURMA/lista_presenca_TURMA.pdf) ou 'gabaritos' (todo o resto)
+    """
+    pasta, nome = os.path.split(relativo)
+    if nome == "lista_presenca_funcionarios.pdf" and not os.path.dirname(pasta):
+        return 'funcionarios'
+    if nome == f"lista_presenca_{os.path.basename(pasta)}.pdf" and os.path.dirname(pasta):
+        return 'listas'
+    return 'gabaritos'
+
+def tipos_gerados(config):
+    """Tipos de arquivo (tipo_da_saida) que uma execução com esta configuração produz"""
+    if config.is_teacher_list:
+        return ['funcionarios']
+    tipos = []
+    if config.gerar_lista_presenca or config.apenas_lista_presenca:
+        tipos.append('listas')
+    if not config.apenas_lista_presenca:
+        tipos.append('gabaritos')
+    return tipos
+
+class ManifestoSaida:
+    """
+    Manifesto da regeneração incremental, guardado em output_dir: para cada arquivo gerado
+    (caminho relativo), a impressão digital dos dados, do modelo e da configuração que o produziram.
+    """
+    NOME_ARQUIVO = ".gabaritos_manifesto.json"
+    VERSAO = 1
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.caminho = os.path.join(output_dir, self.NOME_ARQUIVO)
+        self.arquivos = {}
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                conteudo = json.load(f)
+            if conteudo.get('versao') == self.VERSAO:
+                self.arquivos = conteudo['arquivos']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # Sem manifesto válido: tudo é gerado de novo
+
+    def atualizar(self, relatorio, escopo_total, tipos, gravar=True):
+        """
+        Remove as saídas antigas que esta execução não produziu mais e grava o novo manifesto.
+        Só são removidos arquivos dos `tipos` que a execução gera (tipos_gerados): listas de
+        funcionários e de alunos ficam na mesma pasta, e uma não apaga a outra. Também só das pastas
+        processadas agora (ou de qualquer pasta, se a execução abrangeu todos os registros); com
+        erros ou cancelamento, nada é removido.
+        Sem `gravar` (partições), o manifesto fica para o passo de mesclagem.
+        """
+        removidos = []
+        if not relatorio.erros and not relatorio.cancelado:
+            for relativo in self.arquivos:
+                if relativo in relatorio.arquivos or tipo_da_saida(relativo) not in tipos:
+                    continue
+                if escopo_total or os.path.dirname(relativo) in relatorio.diretorios:
+                    caminho = os.path.join(self.output_dir, relativo)
+                    if os.path.exists(caminho):
+                        os.remove(caminho)
+                        print(f"Arquivo removido (desatualizado): {relativo}")
+                    removidos.append(relativo)
+
+        arquivos = {relativo: impressao for relativo, impressao in self.arquivos.items()
+                    if relativo not in removidos}
+        arquivos.update(relatorio.arquivos)
+        if not gravar:
+            return removidos
+        os.makedirs(self.output_dir, exist_ok=True)
+        with escrita_atomica(self.caminho) as f:
+            f.write(json.dumps({'versao': self.VERSAO, 'arquivos': arquivos}, ensure_ascii=False).encode('utf-8'))
+        self.arquivos = arquivos
+        return removidos
+
+class GravadorEmSegundoPlano:
+    """
+    Threads que gravam no disco os documentos já renderizados em memória, enquanto o processo
+    segue renderizando os próximos (útil quando a pasta de saída está na rede).
+    Os bytes ainda não gravados são limitados: acima de `limite_bytes`, quem renderiza espera.
+    As falhas de gravação ficam guardadas até aguardar().
+    """
+    def __init__(self, threads, limite_bytes=64 * 1024 * 1024):
+        self.limite_bytes = limite_bytes
+        self.fila = queue.Queue()
+        self.falhas = []  # (caminho, bytes, mensagem)
+        self._pendentes = 0
+        self._espaco = threading.Condition()
+        self._threads = [threading.Thread(target=self._trabalhar, daemon=True) for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _trabalhar(self):
+        while True:
+            item = self.fila.get()
+            if item is None:
+                self.fila.task_done()
+                return
+            caminho, conteudo = item
+            try:
+                with escrita_atomica(caminho) as f:
+                    f.write(conteudo)
+            except Exception as e:
+                with self._espaco:
+                    self.falhas.append((caminho, len(conteudo), str(e)))
+            finally:
+                with self._espaco:
+                    self._pendentes -= len(conteudo)
+                    self._espaco.notify_all()
+                self.fila.task_done()
+
+    def gravar(self, caminho, conteudo):
+        with self._espaco:
+            # Um documento maior que o limite passa sozinho, para não travar
+            while self._pendentes and self._pendentes + len(conteudo) > self.limite_bytes:
+                self._espaco.wait()
+            self._pendentes += len(conteudo)
+        self.fila.put((caminho, conteudo))
+
+    def aguardar(self):
+        """Espera as gravações pendentes e devolve (e esquece) as falhas até aqui"""
+        self.fila.join()
+        with self._espaco:
+            falhas, self.falhas = self.falhas, []
+        return falhas
+
+    def fechar(self):
+        for _ in self._threads:
+            self.fila.put(None)
+        for thread in self._threads:
+            thread.join()
+
+class SaidaPastas:
+    """
+    Saída padrão: cada documento vira um arquivo em output_dir/ESCOLA/TURMA.
+    Com `gravadores` > 0, a gravação é feita por um GravadorEmSegundoPlano, criado no primeiro
+    documento (já dentro do processo do pool, se for o caso).
+    """
+    def __init__(self, output_dir, gravadores=0):
+        self.output_dir = output_dir
+        self.gravadores = gravadores
+        self._gravador = None
+        self._pastas = set()  # Pastas já criadas neste processo
+        self._tamanhos = {}  # caminho -> bytes enviados ao gravador, até ser consultado por tamanho()
+
+    def abrir(self, caminho):
+        pasta = os.path.dirname(caminho)
+        if pasta not in self._pastas:
+            os.makedirs(pasta, exist_ok=True)
+            self._pastas.add(pasta)
+        if not self.gravadores:
+            return escrita_atomica(caminho)
+        return self._abrir_em_memoria(caminho)
+
+    @contextmanager
+    def _abrir_em_memoria(self, caminho):
+        conteudo = io.BytesIO()
+        yield conteudo
+        if self._gravador is None:
+            self._gravador = GravadorEmSegundoPlano(self.gravadores)
+        dados = conteudo.getvalue()
+        self._tamanhos[caminho] = len(dados)
+        self._gravador.gravar(caminho, dados)
+
+    def existe(self, caminho):
+        return os.path.exists(caminho)
+
+    def tamanho(self, caminho):
+        if caminho in self._tamanhos:
+            return self._tamanhos.pop(caminho)
+        return os.path.getsize(caminho)
+
+    def concluir(self, confirmar=True):
+        """Espera as gravações do lote; devolve as falhas (caminho, bytes, mensagem)"""
+        return self._gravador.aguardar() if self._gravador is not None else []
+
+    def fechar(self):
+        if self._gravador is not None:
+            self._gravador.fechar()
+            self._gravador = None
+
+class SaidaZip:
+    """
+    Saída compactada: os documentos de cada escola vão direto para output_dir/ESCOLA.zip, mantendo
+    o layout ESCOLA/TURMA/arquivo dentro do arquivo ZIP, sem passar por arquivos soltos no disco.
+    Os .docx já são comprimidos e entram sem nova compressão; os PDFs entram comprimidos.
+    Cada ZIP é gravado num temporário e só substitui o anterior em concluir().
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._abertos = {}  # escola -> (ZipFile, temporário, caminho final)
+        self._tamanhos = {}  # caminho -> bytes gravados, até ser consultado por tamanho()
+
+    def _arquivo_zip(self, escola):
+        if escola not in self._abertos:
+            os.makedirs(self.output_dir, exist_ok=True)
+            temporario = os.path.join(self.output_dir, f".{escola}.zip.{os.getpid()}.tmp")
+            self._abertos[escola] = (zipfile.ZipFile(temporario, 'w'), temporario,
+                                     os.path.join(self.output_dir, escola + ".zip"))
+        return self._abertos[escola][0]
+
+    @contextmanager
+    def abrir(self, caminho):
+        # O documento só entra no ZIP depois de escrito por completo
+        nome = os.path.relpath(caminho, self.output_dir).replace(os.sep, '/')
+        conteudo = io.BytesIO()
+        yield conteudo
+        info = zipfile.ZipInfo(nome, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED if nome.endswith('.docx') else zipfile.ZIP_DEFLATED
+        self._arquivo_zip(nome.split('/', 1)[0]).writestr(info, conteudo.getbuffer())
+        self._tamanhos[caminho] = info.compress_size
+
+    def existe(self, caminho):
+        return False  # O ZIP da escola é sempre montado de novo
+
+    def tamanho(self, caminho):
+        return self._tamanhos.pop(caminho, 0)
+
+    def concluir(self, confirmar=True):
+        """Fecha os ZIPs abertos: publicados com `confirmar`, descartados sem ele"""
+        for arquivo_zip, temporario, final in self._abertos.values():
+            arquivo_zip.close()
+            if confirmar:
+                os.replace(temporario, final)
+            else:
+                os.remove(temporario)
+        self._abertos.clear()
+        return []
+
+    def fechar(self):
+        pass
+
+class ContextoExecucao:
+    """O que todas as unidades de uma execução compartilham: modelo, pasta de saída e configuração"""
+    def __init__(self, modelo, output_dir, config, anteriores=None, cancelamento=None):
+        self.modelo = modelo
+        self.output_dir = output_dir
+        self.config = config
+        # Impressões da execução anterior (regeneração incremental); None = sempre gerar
+        self.anteriores = anteriores
+        self.cancelamento = cancelamento  # Event conferido entre documentos
+        self.interrompido = False  # Parada pedida pela própria execução (limite de memória)
+        self.saida = SaidaZip(output_dir) if config.saida_zip else SaidaPastas(output_dir, config.gravadores)
+        self.impressao_base = impressao_digital(
+            [getattr(config, campo) for campo in CAMPOS_IMPRESSAO_CONFIG],
+            getattr(modelo, 'impressao', None))
+
+    def cancelado(self):
+        return self.interrompido or (self.cancelamento is not None and self.cancelamento.is_set())
+
+    def relativo(self, caminho):
+        return os.path.relpath(caminho, self.output_dir)
+
+    def impressao_pendente(self, relatorio, caminho, *partes):
+        """
+        Impressão digital da saída em `caminho`, ou None se o arquivo já existe e está atualizado
+        (nesse caso ele já fica registrado no relatório e não precisa ser gerado).
+        """
+        impressao = impressao_digital(self.impressao_base, *partes)
+        relativo = self.relativo(caminho)
+        relatorio.diretorios.add(os.path.dirname(relativo))
+        if (self.anteriores is not None and self.anteriores.get(relativo) == impressao
+                and self.saida.existe(caminho)):
+            relatorio.arquivos[relativo] = impressao
+            relatorio.ignorados += 1
+            return None
+        return impressao
+
+    def registrar(self, relatorio, caminho, impressao, contador, quantidade=1):
+        """
+        Registra uma saída gerada (só depois de salva, para não marcar como atualizada uma falha).
+        `contador` ('gabaritos' ou 'listas') e `quantidade` dizem quanto o arquivo somou no relatório.
+        """
+        relatorio.arquivos[self.relativo(caminho)] = impressao
+        relatorio.contagens[caminho] = (contador, quantidade)
+        relatorio.documentos += 1
+        relatorio.bytes_gravados += self.saida.tamanho(caminho)
+
+def processar_unidade(unidade, contexto, agregado=None):
+    """
+    Gera a lista de presença e os gabaritos de uma unidade de trabalho.
+    Com `agregado`, as folhas são anexadas a esse documento em vez de salvas uma a uma.
+    """
+    modelo, output_dir, config, saida = contexto.modelo, contexto.output_dir, contexto.config, contexto.saida
+    relatorio = RelatorioExecucao()
+    escola = unidade.escola
+    escola_dir = os.path.join(output_dir, unidade.pasta_escola)
+
+    if config.is_teacher_list:
+        # Para funcionários, mantém na pasta da escola
+        caminho_lista = os.path.join(escola_dir, "lista_presenca_funcionarios.pdf")
+        impressao = contexto.impressao_pendente(relatorio, caminho_lista, 'lista', escola,
+                                                unidade.funcionarios['NOME DO FUNCIONÁRIO'].tolist())
+        if impressao is not None:
+            try:
+                with relatorio.cronometrar('lista_pdf'):
+                    criar_lista_presenca(
+                        escola, 
+                        "funcionarios",
+                        unidade.funcionarios,
+                        escola_dir,  # Usa diretório da escola
+                        config.titulo_lista,
+                        config.cores,
+                        config.data_lista,
+                        is_teacher_list=True,
+                        saida=saida
+                    )
+                contexto.registrar(relatorio, caminho_lista, impressao, 'listas')
+                relatorio.listas += 1
+            except Exception as e:
+                relatorio.erros.append((escola, None, f"lista de presença: {e}"))
+        return relatorio
+
+    # Para alunos, cria subpasta por turma
+    turma = unidade.turma
+    turma_sanitizada = unidade.pasta_turma
+    turma_dir = os.path.join(escola_dir, turma_sanitizada)
+
+    if config.gerar_lista_presenca or config.apenas_lista_presenca:
+        caminho_lista = os.path.join(turma_dir, f"lista_presenca_{turma_sanitizada}.pdf")
+        impressao = contexto.impressao_pendente(relatorio, caminho_lista, 'lista', escola, turma,
+                                                sorted(unidade.alunos))
+        if impressao is not None:
+            try:
+                with relatorio.cronometrar('lista_pdf'):
+                    criar_lista_presenca(escola, turma_sanitizada, unidade.alunos, turma_dir,
+                                       config.titulo_lista, config.cores, config.data_lista,
+                                       is_teacher_list=False, turma=turma,  # Adicionando a turma como parâmetro
+                                       saida=saida)
+                contexto.registrar(relatorio, caminho_lista, impressao, 'listas')
+                relatorio.listas += 1
+            except Exception as e:
+                relatorio.erros.append((escola, turma, f"lista de presença: {e}"))
+
+    # Só gera os gabaritos se não estiver no modo "apenas lista de presença"
+    if config.apenas_lista_presenca:
+        return relatorio
+
+    if agregado is None and config.agrupamento_gabaritos == "escola":
+        return relatorio  # Documento da escola já atualizado; só as listas foram conferidas
+
+    folhas = folhas_da_unidade(unidade, config)
+    agregado_turma = None
+    if agregado is None and config.agrupamento_gabaritos == "turma":
+        folhas = list(folhas)
+        caminho_turma = os.path.join(turma_dir, f"gabaritos_{turma_sanitizada}{modelo.extensao}")
+        impressao_turma = contexto.impressao_pendente(relatorio, caminho_turma,
+                                                      [dados for dados, _ in folhas])
+        if impressao_turma is None:
+            return relatorio
+        agregado = agregado_turma = modelo.novo_agregado()
+
+    # Um erro numa folha é registrado e não interrompe as demais
+    for dados, nome_base in folhas:
+        if contexto.cancelado():
+            relatorio.cancelado = True
+            break
+        try:
+            if agregado is None:
+                caminho = os.path.join(turma_dir, nome_base + modelo.extensao)
+                impressao = contexto.impressao_pendente(relatorio, caminho, dados)
+                if impressao is None:
+                    continue
+            with relatorio.cronometrar('substituicao'):
+                modelo.preencher(dados)
+            if agregado is not None:
+                with relatorio.cronometrar('agregacao'):
+                    agregado.adicionar()
+                relatorio.gabaritos += 1
+                continue
+            with relatorio.cronometrar('gravacao'), saida.abrir(caminho) as f:
+                modelo.salvar(f)  # Salva na pasta da turma
+            relatorio.gabaritos += 1
+            contexto.registrar(relatorio, caminho, impressao, 'gabaritos')
+        except Exception as e:
+            relatorio.erros.append((escola, turma, f"{nome_base}: {e}"))
+            continue
+        print(f"Arquivo salvo ({'1 aluno' if config.process_mode == 'um_aluno' else '2 alunos'}): {os.path.basename(caminho)}")
+
+    # Documento agregado incompleto (cancelamento) não é salvo; com folhas faltando, é salvo sem impressão
+    # digital, para ser refeito na próxima execução
+    if agregado_turma is not None and agregado_turma.total and not relatorio.cancelado:
+        with relatorio.cronometrar('gravacao'), saida.abrir(caminho_turma) as f:
+            agregado_turma.salvar(f)
+        contexto.registrar(relatorio, caminho_turma, impressao_turma if not relatorio.erros else None,
+                           'gabaritos', agregado_turma.total)
+        print(f"Arquivo salvo ({agregado_turma.total} folhas): {os.path.basename(caminho_turma)}")
+    return relatorio
+
+def montar_lotes(unidades, config):
+    """
+    Agrupa as unidades que precisam ser processadas juntas: no agrupamento por escola todas as
+    turmas da escola vão para o mesmo documento, e na saída em ZIP para o mesmo arquivo ZIP;
+    nos demais modos cada unidade é um lote.
+    As unidades de uma escola chegam em sequência, então os lotes também são gerados sob demanda.
+    """
+    por_escola = config.agrupamento_gabaritos == "escola" and not config.is_teacher_list \
+        and not config.apenas_lista_presenca
+    if not por_escola and not config.saida_zip:
+        for unidade in unidades:
+            yield [unidade]
+        return
+    for _, lote in groupby(unidades, key=lambda unidade: unidade.escola):
+        yield list(lote)
+
+def particionar_lotes(lotes, particao):
+    """
+    Lotes da partição k de N (particao=(k, N), k a partir de 1), na ordem original.
+    Todas as partições calculam a mesma divisão, sem coordenação entre as máquinas: os lotes vão,
+    do maior para o menor em registros (desempate pela escola/turma), para a partição com menos
+    registros até ali (LPT), o que equilibra a quantidade de alunos entre as partições.
+    """
+    k, total = particao
+    lotes = list(lotes)
+    pesos = [sum(unidade.registros for unidade in lote) for lote in lotes]
+    ordem = sorted(range(len(lotes)), key=lambda i: (-pesos[i], DiarioExecucao.chave(lotes[i])))
+    cargas = [(0, indice) for indice in range(total)]  # Heap de (registros, partição)
+    destinos = [0] * len(lotes)
+    for i in ordem:
+        carga, indice = heapq.heappop(cargas)
+        destinos[i] = indice
+        heapq.heappush(cargas, (carga + pesos[i], indice))
+    return [lote for lote, destino in zip(lotes, destinos) if destino == k - 1]
+
+def processar_lote(lote, contexto):
+    """
+    Processa um lote de unidades, salvando o documento único da escola quando for o caso.
+    No fim, a saída do lote é concluída (na saída em ZIP, o ZIP da escola só é publicado se o lote
+    não foi cancelado nem interrompido por um erro; com gravadores em segundo plano, as gravações
+    do lote terminam antes de ele ser dado como concluído e as falhas entram no relatório).
+    """
+    relatorio = RelatorioExecucao()
+    concluido = False
+    try:
+        relatorio.mesclar(_processar_unidades_do_lote(lote, contexto))
+        concluido = True
+    finally:
+        falhas = contexto.saida.concluir(confirmar=concluido and not relatorio.cancelado)
+    turma = lote[0].turma if len(lote) == 1 else None
+    for caminho, tamanho, erro in falhas:
+        relatorio.arquivos.pop(contexto.relativo(caminho), None)  # Não fica como atualizado no manifesto
+        relatorio.documentos -= 1
+        relatorio.bytes_gravados -= tamanho
+        # Como na gravação imediata, as folhas e listas de um arquivo que falhou não são contadas
+        contador, quantidade = relatorio.contagens[caminho]
+        setattr(relatorio, contador, getattr(relatorio, contador) - quantidade)
+        relatorio.erros.append((lote[0].escola, turma, f"{os.path.basename(caminho)}: falha na gravação: {erro}"))
+    relatorio.contagens.clear()  # Só vale dentro do lote
+    return relatorio
+
+def _processar_unidades_do_lote(lote, contexto):
+    modelo, config = contexto.modelo, contexto.config
+    relatorio = RelatorioExecucao()
+    agregado = None
+    if modelo is not None and config.agrupamento_gabaritos == "escola":
+        escola_sanitizada = lote[0].pasta_escola
+        caminho = os.path.join(contexto.output_dir, escola_sanitizada,
+                               f"gabaritos_{escola_sanitizada}{modelo.extensao}")
+        impressao = contexto.impressao_pendente(
+            relatorio, caminho, [[dados for dados, _ in folhas_da_unidade(unidade, config)] for unidade in lote])
+        if impressao is not None:
+            agregado = modelo.novo_agregado()
+    for unidade in lote:
+        if contexto.cancelado():
+            relatorio.cancelado = True
+            break
+        relatorio.mesclar(processar_unidade(unidade, contexto, agregado))
+    if agregado is not None and agregado.total and not relatorio.cancelado:
+        with relatorio.cronometrar('gravacao'), contexto.saida.abrir(caminho) as f:
+            agregado.salvar(f)
+        contexto.registrar(relatorio, caminho, impressao if not relatorio.erros else None,
+                           'gabaritos', agregado.total)
+        print(f"Arquivo salvo ({agregado.total} folhas): {os.path.basename(caminho)}")
+    return relatorio
+
+# Estado de cada processo do pool: o modelo é compilado uma vez por processo
+_estado_processo = {}
+
+def _destino_mensagens():
+    """Para onde os processos do pool mandam as mensagens, seguindo o stdout do processo principal"""
+    if sys.stdout is sys.stderr:
+        return "stderr"
+    if sys.stdout is not sys.__stdout__:
+        return "nulo"
+    return None
+
+def _iniciar_processo(modelo_path, precisa_modelo, output_dir, config, anteriores, cancelamento,
+                      destino_mensagens=None):
+    # Mantém o stdout livre para o resumo em JSON da linha de comando (ou silencia, com a barra de progresso)
+    if destino_mensagens == "stderr":
+        sys.stdout = sys.stderr
+    elif destino_mensagens == "nulo":
+        sys.stdout = open(os.devnull, 'w')
+    modelo = carregar_modelo(modelo_path, config) if precisa_modelo else None
+    _estado_processo['contexto'] = ContextoExecucao(modelo, output_dir, config, anteriores, cancelamento)
+
+def processar_lote_protegido(lote, contexto):
+    """
+    processar_lote que devolve o erro no relatório em vez de interromper a execução.
+    Depois do lote, confere o limite de memória do processo (Configuracao.limite_memoria_mb).
+    """
+    try:
+        relatorio = processar_lote(lote, contexto)
+    except Exception as e:
+        relatorio = RelatorioExecucao()
+        turma = lote[0].turma if len(lote) == 1 else None
+        relatorio.erros.append((lote[0].escola, turma, str(e)))
+    relatorio.limite_memoria = verificar_limite_memoria(contexto.config)
+    return relatorio
+
+def _processar_lote_no_pool(lote):
+    return processar_lote_protegido(lote, _estado_processo['contexto'])
+
+def executar_lotes_em_paralelo(lotes, modelo_path, precisa_modelo, contexto):
+    """
+    Distribui os lotes (escola, turma) entre processos e devolve (lote, relatório) na ordem dos lotes.
+    No máximo dois lotes por processo ficam pendentes, para não materializar todos de uma vez.
+    O cancelamento do processo principal é repassado aos processos por um multiprocessing.Event.
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait
+    config = contexto.config
+    pendentes = deque()
+    cancelamento = multiprocessing.Event()
+
+    def aguardar(futuro):
+        while not futuro.done():
+            wait([futuro], timeout=0.2)
+            if contexto.cancelado() and not cancelamento.is_set():
+                cancelamento.set()
+                for _, pendente in pendentes:
+                    pendente.cancel()  # Lotes que ainda não começaram
+        return None if futuro.cancelled() else futuro.result()
+
+    with ProcessPoolExecutor(max_workers=config.num_processos, initializer=_iniciar_processo,
+                             initargs=(modelo_path, precisa_modelo, contexto.output_dir, config,
+                                       contexto.anteriores, cancelamento, _destino_mensagens())) as pool:
+        for lote in lotes:
+            pendentes.append((lote, pool.submit(_processar_lote_no_pool, lote)))
+            if len(pendentes) >= 2 * config.num_processos:
+                pronto, futuro = pendentes.popleft()
+                relatorio_lote = aguardar(futuro)
+                if relatorio_lote is not None:
+                    yield pronto, relatorio_lote
+        while pendentes:
+            pronto, futuro = pendentes.popleft()
+            relatorio_lote = aguardar(futuro)
+            if relatorio_lote is not None:
+                yield pronto, relatorio_lote
+
+class DiarioExecucao:
+    """
+    Diário de checkpoints em output_dir: a primeira linha identifica a execução (dados, modelo e
+    configuração) e cada linha seguinte registra um lote concluído sem erros, com seus arquivos.
+    Com Configuracao.retomar, uma execução interrompida continua do ponto em que parou, pulando os
+    lotes registrados. O diário é apagado quando a execução termina completa e sem erros; uma
+    exceção no meio (Ctrl-C, processo do pool que morreu) o mantém para a próxima execução.
+    """
+    NOME_ARQUIVO = ".gabaritos_progresso.jsonl"
+
+    def __init__(self, output_dir, impressao, retomar=False, nome_arquivo=None):
+        self.caminho = os.path.join(output_dir, nome_arquivo or self.NOME_ARQUIVO)
+        self.concluidos = self._ler(impressao) if retomar else None
+        os.makedirs(output_dir, exist_ok=True)
+        if self.concluidos is None:
+            if retomar:
+                print("Nenhum progresso compatível para retomar; a geração começa do início.")
+            self.concluidos = {}
+            self.arquivo = open(self.caminho, 'w', encoding='utf-8')
+            self._escrever({'execucao': impressao})
         else:
-            df_filtrado = df[mask_escolas].copy()
+            print(f"Retomando execução: {len(self.concluidos)} lote(s) já concluído(s).")
+            self.arquivo = open(self.caminho, 'a', encoding='utf-8')
+
+    def _ler(self, impressao):
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                linhas = f.readlines()
+        except OSError:
+            return None
+        if not linhas:
+            return None
+        try:
+            if json.loads(linhas[0]).get('execucao') != impressao:
+                return None
+        except ValueError:
+            return None
+        concluidos = {}
+        for linha in linhas[1:]:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                break  # Última linha cortada por uma queda: o lote é refeito
+            concluidos[registro['lote']] = registro['arquivos']
+        return concluidos
+
+    def _escrever(self, registro):
+        self.arquivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+        self.arquivo.flush()
+        os.fsync(self.arquivo.fileno())
+
+    @staticmethod
+    def chave(lote):
+        turma = lote[0].turma if len(lote) == 1 else None
+        return json.dumps([lote[0].escola, turma], ensure_ascii=False, default=str)
+
+    def concluido(self, lote):
+        """Arquivos (caminho relativo -> impressão) do lote, se ele já foi concluído; senão None"""
+        return self.concluidos.get(self.chave(lote))
+
+    def registrar(self, lote, relatorio):
+        if not relatorio.erros and not relatorio.cancelado:
+            self._escrever({'lote': self.chave(lote), 'arquivos': relatorio.arquivos})
+
+    def finalizar(self, relatorio, terminou):
+        """Fecha o diário; só o apaga se todos os lotes foram processados (`terminou`) sem erros"""
+        self.arquivo.close()
+        if terminou and not relatorio.erros and not relatorio.cancelado:
+            os.remove(self.caminho)
+
+def lotes_pendentes(lotes, contexto, diario, ao_pular):
+    """Lotes que ainda precisam ser gerados: para no cancelamento e pula os já concluídos no diário"""
+    for lote in lotes:
+        if contexto.cancelado():
+            return
+        arquivos = diario.concluido(lote)
+        if arquivos is not None:
+            ao_pular(lote, arquivos)
+            continue
+        yield lote
+
+def executar_geracao(csv_path, modelo_path, output_dir, config, etapas_selecionadas, escolas_selecionadas,
+                     instrumentacao=None, cancelamento=None):
+    """
+    Executa a geração completa e devolve o RelatorioExecucao (erros gerais são levantados).
+    `cancelamento` (threading.Event) interrompe a geração no próximo limite entre documentos.
+    Erros de uma folha, lista ou lote ficam no relatório e não interrompem os demais.
+    """
+    if config.incremental and config.saida_zip:
+        raise ValueError("A geração incremental não é compatível com a saída em ZIP")
+    # Mesma regra da interface: o modelo Word só é dispensado para listas ou gabaritos em PDF
+    if (not modelo_path and not config.is_teacher_list and not config.apenas_lista_presenca
+            and config.formato_gabarito != "pdf"):
+        raise ValueError("Informe o modelo Word (--modelo) ou use --formato pdf / --apenas-lista")
+    if config.limite_memoria_mb and memoria_residente_mb() is None:
+        raise ValueError("Não há como medir a memória neste sistema para aplicar o limite de memória "
+                         "(instale o psutil: pip install psutil)")
+    instrumentacao = instrumentacao or Instrumentacao()
+    relatorio = RelatorioExecucao()
+    inicio = time.perf_counter()
+    escopo_total = escolas_selecionadas is None and not etapas_selecionadas
+    with instrumentacao.sessao(relatorio):
+        with relatorio.cronometrar('leitura_csv'):
+            cache = CacheCsv(config.diretorio_cache) if config.usar_cache else None
+            df_filtrado, pares = carregar_registros(csv_path, escolas_selecionadas, etapas_selecionadas, cache=cache)
         
         if df_filtrado.empty:
-            return True, "Nenhum registro encontrado para as escolas/etapas selecionadas."
-            
-        escolas_com_dados = df_filtrado['ESCOLA'].unique()
+            if config.particao:
+                gravar_relatorio_particao(csv_path, modelo_path, output_dir, config, etapas_selecionadas,
+                                          escolas_selecionadas, relatorio, escopo_total, inicio)
+            return relatorio
+        relatorio.registros = len(df_filtrado)
 
-        for escola in escolas_com_dados:
-            escola_df = df_filtrado[df_filtrado['ESCOLA'] == escola]
-            if escola_df.empty:
-                continue
-                
-            escola_sanitizada = sanitizar_nome(escola)
-            escola_dir = os.path.join(output_dir, escola_sanitizada)
-            os.makedirs(escola_dir, exist_ok=True)
-
-            if config.is_teacher_list:
-                # Para funcionários, mantém na pasta da escola
-                funcionarios = get_unique_teachers(escola_df)
-                criar_lista_presenca(
-                    escola, 
-                    "funcionarios",
-                    funcionarios,
-                    escola_dir,  # Usa diretório da escola
-                    config.titulo_lista,
-                    config.cores,
-                    config.data_lista,
-                    is_teacher_list=True
-                )
+        unidades = montar_unidades(df_filtrado, config, pares)
+        del df_filtrado, pares  # As unidades só precisam do índice e das colunas usadas
+        lotes = montar_lotes(unidades, config)
+        if config.particao:
+            lotes = particionar_lotes(lotes, config.particao)
+            relatorio.registros = sum(unidade.registros for lote in lotes for unidade in lote)
+        instrumentacao.iniciar(relatorio.registros)
+        precisa_modelo = not config.is_teacher_list and not config.apenas_lista_presenca
+
+        # O modelo é lido e compilado uma única vez para toda a execução
+        # (no modo paralelo isso também valida o arquivo antes de iniciar os processos)
+        with relatorio.cronometrar('modelo'):
+            modelo = carregar_modelo(modelo_path, config) if precisa_modelo else None
+        manifesto = ManifestoSaida(output_dir) if config.incremental else None
+        contexto = ContextoExecucao(modelo, output_dir, config, manifesto.arquivos if manifesto else None,
+                                    cancelamento)
+        info_csv = os.stat(csv_path)
+        diario = DiarioExecucao(output_dir, impressao_digital(
+            contexto.impressao_base, config.is_teacher_list, config.apenas_lista_presenca,
+            config.gerar_lista_presenca, config.saida_zip, os.path.abspath(csv_path), info_csv.st_size,
+            info_csv.st_mtime_ns, escolas_selecionadas, etapas_selecionadas, config.particao), config.retomar,
+            f".gabaritos_progresso_{config.particao[0]}de{config.particao[1]}.jsonl" if config.particao else None)
+
+        def concluir(lote, relatorio_lote):
+            relatorio.mesclar(relatorio_lote)
+            diario.registrar(lote, relatorio_lote)
+            instrumentacao.lote_concluido(lote, relatorio_lote)
+            if relatorio_lote.limite_memoria:
+                contexto.interrompido = True  # Para de distribuir lotes; dá para continuar com --retomar
+
+        def pular(lote, arquivos):
+            # Lote concluído numa execução anterior: entra no relatório sem ser gerado de novo
+            relatorio_lote = RelatorioExecucao()
+            relatorio_lote.arquivos = arquivos
+            relatorio_lote.diretorios = {os.path.dirname(relativo) for relativo in arquivos}
+            relatorio_lote.ignorados = len(arquivos)
+            relatorio.mesclar(relatorio_lote)
+            instrumentacao.lote_concluido(lote, relatorio_lote)
+
+        terminou = False
+        try:
+            lotes = lotes_pendentes(lotes, contexto, diario, pular)
+            if config.num_processos > 1:
+                resultados = executar_lotes_em_paralelo(lotes, modelo_path, precisa_modelo, contexto)
             else:
-                # Para alunos, cria subpasta por turma
-                # Modificando como o groupby é processado para evitar o formato de tupla
-                for turma, grupo in escola_df.groupby('TURMA'):
-                    # Remove os parênteses e vírgula do nome da turma
-                    turma = str(turma).strip("(),'")  # Remove (, ), e vírgula
-                    turma_sanitizada = sanitizar_nome(turma)
-                    # Cria subdiretório para a turma
-                    turma_dir = os.path.join(escola_dir, turma_sanitizada)
-                    os.makedirs(turma_dir, exist_ok=True)
-
-                    alunos = grupo['NOME DO ALUNO'].tolist()
-                    # Fix professor handling - replace NaN with empty string
-                    professor_regente = grupo['PROFESSOR REGENTE'].iloc[0]
-                    professor_regente = '' if pd.isna(professor_regente) else professor_regente
-                    
-                    if config.gerar_lista_presenca or config.apenas_lista_presenca:
-                        criar_lista_presenca(escola, turma_sanitizada, alunos, turma_dir,
-                                           config.titulo_lista, config.cores, config.data_lista,
-                                           is_teacher_list=False, turma=turma)  # Adicionando a turma como parâmetro
-    
-                    # Só gera os gabaritos se não estiver no modo "apenas lista de presença"
-                    if not config.apenas_lista_presenca:
-                        if config.process_mode == "um_aluno":
-                            for aluno in alunos:
-                                doc = Document(modelo_path)
-                                dados_aluno = {
-                                    '$VARIÁVEL ESCOLA': escola,
-                                    '$VARIÁVEL TURMA': turma,  # Usando a turma já limpa
-                                    '$VARIÁVEL PROFESSOR REGENTE': professor_regente,
-                                    '$VARIÁVEL NOME DO ALUNO': aluno,
-                                    '$VARIÁVEL NOME DO ALUNO 2': ''
-                                }
-                                substituir_variaveis_em_tudo(doc, dados_aluno)
-                                nome_arquivo = f"{sanitizar_nome(aluno)}_gabarito.docx"
-                                doc.save(os.path.join(turma_dir, nome_arquivo))  # Salva na pasta da turma
-                                print(f"Arquivo salvo (1 aluno): {nome_arquivo}")
-
-                        else:
-                            for i in range(0, len(alunos), 2):
-                                aluno1 = alunos[i]
-                                aluno2 = alunos[i + 1] if (i + 1) < len(alunos) else None
-                                doc = Document(modelo_path)
-                                dados_alunos = {
-                                    '$VARIÁVEL ESCOLA': escola,
-                                    '$VARIÁVEL TURMA': turma,
-                                    '$VARIÁVEL PROFESSOR REGENTE': professor_regente,
-                                    '$VARIÁVEL NOME DO ALUNO': aluno1,
-                                    '$VARIÁVEL NOME DO ALUNO 2': aluno2 if aluno2 else ''
-                                }
-                                substituir_variaveis_em_tudo(doc, dados_alunos)
-                                aluno1_sanitizado = sanitizar_nome(aluno1)
-                                if aluno2:
-                                    aluno2_sanitizado = sanitizar_nome(aluno2)
-                                    nome_arquivo = f"{aluno1_sanitizado}_e_{aluno2_sanitizado}_gabarito.docx"
-                                else:
-                                    nome_arquivo = f"{aluno1_sanitizado}_gabarito.docx"
-                                doc.save(os.path.join(turma_dir, nome_arquivo))  # Salva na pasta da turma
-                                print(f"Arquivo salvo (2 alunos): {nome_arquivo}")
-
-        return True, "Documentos gerados com sucesso!"
+                resultados = ((lote, processar_lote_protegido(lote, contexto)) for lote in lotes)
+            for lote, relatorio_lote in resultados:
+                concluir(lote, relatorio_lote)
+            terminou = True
+            relatorio.cancelado = relatorio.cancelado or contexto.cancelado()
+            if relatorio.limite_memoria:
+                relatorio.erros.append((None, None, relatorio.limite_memoria + "; geração interrompida"))
+        finally:
+            contexto.saida.fechar()
+            diario.finalizar(relatorio, terminou)
+
+        if manifesto is not None:
+            # Uma partição só conhece as próprias pastas; o manifesto completo sai da mesclagem
+            relatorio.removidos = len(manifesto.atualizar(relatorio, escopo_total and not config.particao,
+                                                          tipos_gerados(config), gravar=not config.particao))
+        if config.particao:
+            gravar_relatorio_particao(csv_path, modelo_path, output_dir, config, etapas_selecionadas,
+                                      escolas_selecionadas, relatorio, escopo_total, inicio)
+    return relatorio
+
+PREFIXO_RELATORIO_PARTICAO = ".gabaritos_particao_"
+
+def impressao_particionada(csv_path, modelo_path, config, etapas_selecionadas, escolas_selecionadas):
+    """
+    Identifica a execução dividida em partições pelo conteúdo dos arquivos (e não pelo caminho),
+    para que partições de máquinas diferentes sejam reconhecidas como da mesma execução
+    """
+    def conteudo(caminho):
+        return CacheCsv._hash_conteudo(caminho) if caminho and os.path.isfile(caminho) else None
+    return impressao_digital([getattr(config, campo) for campo in CAMPOS_IMPRESSAO_CONFIG],
+                             config.is_teacher_list, config.apenas_lista_presenca, config.gerar_lista_presenca,
+                             config.saida_zip, config.particao[1], conteudo(csv_path), conteudo(modelo_path),
+                             sorted(escolas_selecionadas) if escolas_selecionadas is not None else None,
+                             sorted(etapas_selecionadas or []))
+
+def gravar_relatorio_particao(csv_path, modelo_path, output_dir, config, etapas_selecionadas,
+                              escolas_selecionadas, relatorio, escopo_total, inicio):
+    """Grava em output_dir o relatório da partição, lido depois por mesclar_particoes"""
+    k, total = config.particao
+    conteudo = {
+        'particao': [k, total],
+        'impressao': impressao_particionada(csv_path, modelo_path, config, etapas_selecionadas,
+                                            escolas_selecionadas),
+        'saida': os.path.abspath(output_dir),  # Só informativo: a pasta pode ser movida até a mesclagem
+        'saida_zip': config.saida_zip,
+        'incremental': config.incremental,
+        'tipos': tipos_gerados(config),
+        'escopo_total': escopo_total,
+        'duracao_s': round(time.perf_counter() - inicio, 3),
+        'relatorio': relatorio.como_dict(),
+        'arquivos': relatorio.arquivos,
+        'diretorios': sorted(relatorio.diretorios),
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with escrita_atomica(os.path.join(output_dir, f"{PREFIXO_RELATORIO_PARTICAO}{k}de{total}.json")) as f:
+        f.write(json.dumps(conteudo, ensure_ascii=False, default=str).encode('utf-8'))
+
+def _ler_relatorios_particao(caminhos):
+    relatorios = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            arquivos = sorted(os.path.join(caminho, nome) for nome in os.listdir(caminho)
+                              if nome.startswith(PREFIXO_RELATORIO_PARTICAO) and nome.endswith('.json'))
+            if not arquivos:
+                raise ValueError(f"Nenhum relatório de partição em {caminho}")
+        else:
+            arquivos = [caminho]
+        for arquivo in arquivos:
+            with open(arquivo, encoding='utf-8') as f:
+                dados = json.load(f)
+            # Os arquivos da partição estão junto do relatório, onde quer que a pasta esteja agora
+            dados['pasta'] = os.path.dirname(os.path.abspath(arquivo))
+            relatorios.append(dados)
+    return relatorios
+
+def _arquivos_da_particao(dados):
+    """Caminhos relativos, no disco, dos arquivos que a partição gerou (na saída em ZIP, os ZIPs das escolas)"""
+    if dados.get('saida_zip'):
+        return sorted({re.split(r'[\\/]', relativo, maxsplit=1)[0] + ".zip" for relativo in dados['arquivos']})
+    return sorted(dados['arquivos'])
+
+def _mover_saida_particao(dados, destino):
+    """Move para a pasta final os arquivos gerados por uma partição"""
+    for relativo in _arquivos_da_particao(dados):
+        origem = os.path.join(dados['pasta'], relativo)
+        if os.path.exists(origem):
+            final = os.path.join(destino, relativo)
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            shutil.move(origem, final)  # os.replace, ou cópia entre discos diferentes
+
+def mesclar_particoes(caminhos, output_dir):
+    """
+    Junta as partições de uma execução (pastas de saída ou relatórios .json gravados com
+    Configuracao.particao): move os arquivos para output_dir, monta o manifesto incremental
+    completo e devolve um resumo no mesmo formato do de uma execução única. A duração é a da
+    partição mais lenta; os tempos por etapa são somados, como os de vários processos.
+    """
+    relatorios = _ler_relatorios_particao(caminhos)
+    total = relatorios[0]['particao'][1]
+    if any(dados['impressao'] != relatorios[0]['impressao'] or dados['particao'][1] != total
+           for dados in relatorios):
+        raise ValueError("As partições são de execuções diferentes (dados, modelo ou configuração)")
+    por_indice = {}
+    for dados in relatorios:
+        if dados['particao'][0] in por_indice:
+            raise ValueError(f"Partição {dados['particao'][0]}/{total} informada mais de uma vez")
+        por_indice[dados['particao'][0]] = dados
+    faltando = [str(k) for k in range(1, total + 1) if k not in por_indice]
+    if faltando:
+        raise ValueError(f"Faltam as partições {', '.join(faltando)} de {total}")
+
+    # Confere todos os arquivos antes de mover qualquer um. Um arquivo que já está na pasta final
+    # conta como presente: saída compartilhada, arquivo mantido pelo modo incremental ou mesclagem repetida.
+    destino = os.path.abspath(output_dir)
+    ausentes = [os.path.join(dados['pasta'], relativo) for dados in relatorios
+                for relativo in _arquivos_da_particao(dados)
+                if not os.path.exists(os.path.join(dados['pasta'], relativo))
+                and not os.path.exists(os.path.join(destino, relativo))]
+    if ausentes:
+        exemplos = "\n".join(ausentes[:10])
+        raise ValueError(f"{len(ausentes)} arquivo(s) das partições não encontrado(s):\n{exemplos}")
+
+    relatorio = RelatorioExecucao()
+    for k in sorted(por_indice):
+        dados = por_indice[k]
+        parcial = RelatorioExecucao.de_dict(dados['relatorio'])
+        parcial.arquivos = dados['arquivos']
+        parcial.diretorios = set(dados['diretorios'])
+        relatorio.mesclar(parcial)
+        relatorio.registros += parcial.registros
+        relatorio.removidos += parcial.removidos
+        if os.path.normcase(dados['pasta']) != os.path.normcase(destino):
+            _mover_saida_particao(dados, destino)
+    if relatorios[0]['incremental']:
+        # As partições já apagaram as saídas antigas das próprias pastas; aqui sai o resto
+        relatorio.removidos += len(ManifestoSaida(destino).atualizar(relatorio, relatorios[0]['escopo_total'],
+                                                                     relatorios[0]['tipos']))
+
+    resumo = {'saida': output_dir, **relatorio.como_dict(), 'sucesso': not relatorio.erros,
+              'mensagem': relatorio.mensagem(),
+              'duracao_s': max(dados['duracao_s'] for dados in relatorios),
+              'particoes': [{'particao': k, 'registros': por_indice[k]['relatorio']['registros'],
+                             'documentos': por_indice[k]['relatorio']['documentos'],
+                             'erros': len(por_indice[k]['relatorio']['erros']),
+                             'duracao_s': por_indice[k]['duracao_s']} for k in sorted(por_indice)]}
+    return resumo
+
+def criar_gabaritos(csv_path, modelo_path, output_dir, config, etapas_selecionadas, escolas_selecionadas,
+                    instrumentacao=None):
+    try:
+        relatorio = executar_geracao(csv_path, modelo_path, output_dir, config,
+                                     etapas_selecionadas, escolas_selecionadas, instrumentacao)
+        return not relatorio.erros, relatorio.mensagem()
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -286,99 +2577,53 @@ class App:
         self.root = root
         self.root.title("Gerador de Gabaritos e Lista de Presença")
         self.root.geometry("600x780")  
-        self.root.minsize(580, 860) 
+        self.root.minsize(580, 920) 
+        self.root.protocol("WM_DELETE_WINDOW", self.fechar)
         
         # Inicialização de todas as variáveis no início
         self.csv_path = None
         self.modelo_path = None
         self.output_dir = None
-        self.process_mode = StringVar(value="dois_alunos")
+        self.process_mode = tk.StringVar(value="dois_alunos")
         self.gerar_lista_presenca = tk.BooleanVar(value=True)
         self.apenas_lista_presenca = tk.BooleanVar(value=False)  # Nova variável
         self.titulo_lista = tk.StringVar(value="Lista de Presença")
         self.data_lista = tk.StringVar(value="")  # Nova variável para data
-        self.paleta_selecionada = StringVar(value="Verde Suave")
-        self.lista_tipo = StringVar(value="alunos")  # Add this after other initializations
+        self.paleta_selecionada = tk.StringVar(value="Verde Suave")
+        self.lista_tipo = tk.StringVar(value="alunos")  # Add this after other initializations
+        self.num_processos = tk.IntVar(value=1)  # Processos em paralelo na geração
+        self.agrupamento_gabaritos = tk.StringVar(value="arquivo")
+        self.formato_gabarito = tk.StringVar(value="docx")
+        # Cache binário do CSV entre execuções. Desligado por padrão: a primeira execução com cache
+        # carrega o arquivo inteiro, em vez de ler só as escolas/etapas selecionadas
+        self.usar_cache = tk.BooleanVar(value=False)
+        self.incremental = tk.BooleanVar(value=False)  # Regenera só o que mudou na pasta de saída
+        self.retomar = tk.BooleanVar(value=False)  # Continua uma geração interrompida na pasta de saída
+        self.saida_zip = tk.BooleanVar(value=False)  # Um ZIP por escola em vez de pastas
+        # Geração em segundo plano: a thread envia os eventos pela fila e a janela os consome
+        self.trabalho = None
+        self.fila_eventos = queue.Queue()
+        self.cancelamento = None
+        self.fechando = False
         
         # Paletas de cores pasteis pré-definidas
-        self.paletas_cores = {
-            "Verde Suave": {
-                "titulo": "#2C3E50",
-                "cabecalho": "#34495E",
-                "linha": "#3ddb65",
-                "tabela_header": "#98FB98"
-            },
-            "Rosa Delicado": {
-                "titulo": "#4A4A4A",
-                "cabecalho": "#5D4E6D",
-                "linha": "#FFB6C1",
-                "tabela_header": "#FFC0CB"
-            },
-            "Azul Sereno": {
-                "titulo": "#2C3E50",
-                "cabecalho": "#34495E",
-                "linha": "#87CEEB",
-                "tabela_header": "#ADD8E6"
-            },
-            "Lilás Suave": {
-                "titulo": "#4A4A4A",
-                "cabecalho": "#5D4E6D",
-                "linha": "#DDA0DD",
-                "tabela_header": "#E6E6FA"
-            },
-            "Marrom Café": {
-                "titulo": "#3E2723",
-                "cabecalho": "#4E342E",
-                "linha": "#8D6E63",
-                "tabela_header": "#D7CCC8"
-            },
-            "Cinza Elegante": {
-                "titulo": "#263238",
-                "cabecalho": "#37474F",
-                "linha": "#78909C",
-                "tabela_header": "#CFD8DC"
-            },
-            "Verde Menta": {
-                "titulo": "#004D40",
-                "cabecalho": "#00695C",
-                "linha": "#4DB6AC",
-                "tabela_header": "#B2DFDB"
-            },
-            "Roxo Real": {
-                "titulo": "#311B92",
-                "cabecalho": "#4527A0",
-                "linha": "#7E57C2",
-                "tabela_header": "#D1C4E9"
-            },
-            "Laranja Solar": {
-                "titulo": "#E65100",
-                "cabecalho": "#EF6C00",
-                "linha": "#FFB74D",
-                "tabela_header": "#FFE0B2"
-            },
-            "Azul Corporativo": {
-                "titulo": "#0D47A1",
-                "cabecalho": "#1565C0",
-                "linha": "#42A5F5",
-                "tabela_header": "#BBDEFB"
-            }
-        }
+        self.paletas_cores = PALETAS_CORES
         
         tk.Label(root, text="Gerador de Gabaritos", font=("Arial", 14, "bold")).pack(pady=10)
         
         # Adicionar campo para título da lista e data
-        titulo_frame = Frame(root)
+        titulo_frame = tk.Frame(root)
         titulo_frame.pack(pady=5, padx=10, fill=tk.X)
         tk.Label(titulo_frame, text="Título da Lista:").pack(side=tk.LEFT)
         tk.Entry(titulo_frame, textvariable=self.titulo_lista, width=40).pack(side=tk.LEFT, padx=5)
         
-        data_frame = Frame(root)
+        data_frame = tk.Frame(root)
         data_frame.pack(pady=5, padx=10, fill=tk.X)
         tk.Label(data_frame, text="Data da Lista:").pack(side=tk.LEFT)
         tk.Entry(data_frame, textvariable=self.data_lista, width=40).pack(side=tk.LEFT, padx=5)
         tk.Label(data_frame, text="(Opcional - deixe em branco para preenchimento manual)").pack(side=tk.LEFT, padx=5)
         
-        frame_botoes = Frame(root)
+        frame_botoes = tk.Frame(root)
         frame_botoes.pack(pady=5, padx=10, fill=tk.X)
         
         tk.Button(frame_botoes, text="1. Selecionar CSV dos Alunos", command=self.selecionar_csv).pack(fill=tk.X)
@@ -396,10 +2641,10 @@ class App:
         # Após os botões de seleção de arquivos, adicionar seletor de escolas
         tk.Label(root, text="4. Selecione as Escolas:", font=("Arial", 10, "bold")).pack(pady=(15, 0))
         
-        escolas_frame = Frame(root)
+        escolas_frame = tk.Frame(root)
         escolas_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-        escolas_scrollbar = Scrollbar(escolas_frame, orient=tk.VERTICAL)
-        self.escolas_listbox = Listbox(
+        escolas_scrollbar = tk.Scrollbar(escolas_frame, orient=tk.VERTICAL)
+        self.escolas_listbox = tk.Listbox(
             escolas_frame,
             selectmode=tk.MULTIPLE,
             yscrollcommand=escolas_scrollbar.set,
@@ -412,10 +2657,10 @@ class App:
 
         tk.Label(root, text="5. Selecione as Etapas de Ensino:", font=("Arial", 10, "bold")).pack(pady=(15, 0))
         
-        etapas_frame = Frame(root)
+        etapas_frame = tk.Frame(root)
         etapas_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-        scrollbar = Scrollbar(etapas_frame, orient=tk.VERTICAL)
-        self.etapas_listbox = Listbox(
+        scrollbar = tk.Scrollbar(etapas_frame, orient=tk.VERTICAL)
+        self.etapas_listbox = tk.Listbox(
             etapas_frame, 
             selectmode=tk.MULTIPLE, 
             yscrollcommand=scrollbar.set, 
@@ -426,21 +2671,45 @@ class App:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.etapas_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        opcoes_frame = Frame(root)
+        opcoes_frame = tk.Frame(root)
         opcoes_frame.pack(pady=10)
         tk.Label(opcoes_frame, text="Modo de Geração:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=(0, 10))
-        Radiobutton(opcoes_frame, text="Um aluno por folha", variable=self.process_mode, value="um_aluno").pack(side=tk.LEFT)
-        Radiobutton(opcoes_frame, text="Dois alunos por folha", variable=self.process_mode, value="dois_alunos").pack(side=tk.LEFT)
+        tk.Radiobutton(opcoes_frame, text="Um aluno por folha", variable=self.process_mode, value="um_aluno").pack(side=tk.LEFT)
+        tk.Radiobutton(opcoes_frame, text="Dois alunos por folha", variable=self.process_mode, value="dois_alunos").pack(side=tk.LEFT)
+        tk.Label(opcoes_frame, text="Processos:").pack(side=tk.LEFT, padx=(10, 0))
+        tk.Spinbox(opcoes_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.num_processos,
+                   width=3).pack(side=tk.LEFT)
+
+        agrupamento_frame = tk.Frame(root)
+        agrupamento_frame.pack(pady=5)
+        tk.Label(agrupamento_frame, text="Arquivos de Gabarito:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=(0, 10))
+        tk.Radiobutton(agrupamento_frame, text="Um por folha", variable=self.agrupamento_gabaritos, value="arquivo").pack(side=tk.LEFT)
+        tk.Radiobutton(agrupamento_frame, text="Um por turma", variable=self.agrupamento_gabaritos, value="turma").pack(side=tk.LEFT)
+        tk.Radiobutton(agrupamento_frame, text="Um por escola", variable=self.agrupamento_gabaritos, value="escola").pack(side=tk.LEFT)
+
+        formato_frame = tk.Frame(root)
+        formato_frame.pack(pady=5)
+        tk.Label(formato_frame, text="Formato do Gabarito:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=(0, 10))
+        tk.Radiobutton(formato_frame, text="Word (modelo .docx)", variable=self.formato_gabarito, value="docx").pack(side=tk.LEFT)
+        tk.Radiobutton(formato_frame, text="PDF (sem modelo)", variable=self.formato_gabarito, value="pdf").pack(side=tk.LEFT)
 
         # Adicionar os checkboxes em um frame separado
-        check_frame = Frame(root)
+        check_frame = tk.Frame(root)
         check_frame.pack(pady=5)
         tk.Checkbutton(check_frame, text="Gerar também a Lista de Presença em PDF", 
                       variable=self.gerar_lista_presenca).pack(side=tk.LEFT, padx=5)
         tk.Checkbutton(check_frame, text="Gerar apenas Lista de Presença", 
                       variable=self.apenas_lista_presenca).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(check_frame, text="Usar cache do CSV", 
+                      variable=self.usar_cache).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(check_frame, text="Gerar apenas o que mudou", 
+                      variable=self.incremental).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(check_frame, text="Retomar geração interrompida", 
+                      variable=self.retomar).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(check_frame, text="Compactar cada escola em ZIP", 
+                      variable=self.saida_zip).pack(side=tk.LEFT, padx=5)
 
-        botao_gerar = tk.Button(
+        self.botao_gerar = botao_gerar = tk.Button(
             root, 
             text="GERAR DOCUMENTOS", 
             command=self.gerar,
@@ -453,7 +2722,16 @@ class App:
             pady=10,
             cursor="hand2" 
         )
-        botao_gerar.pack(pady=20)
+        botao_gerar.pack(pady=(20, 5))
+
+        progresso_frame = tk.Frame(root)
+        progresso_frame.pack(pady=(0, 5), padx=10, fill=tk.X)
+        self.barra_progresso = ttk.Progressbar(progresso_frame, maximum=100)
+        self.barra_progresso.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.botao_cancelar = tk.Button(progresso_frame, text="Cancelar", command=self.cancelar, state=tk.DISABLED)
+        self.botao_cancelar.pack(side=tk.LEFT, padx=(5, 0))
+        self.status_label = tk.Label(root, text="", fg="gray")
+        self.status_label.pack()
         
         # Adiciona efeito hover
         def on_enter(e):
@@ -466,12 +2744,12 @@ class App:
         botao_gerar.bind("<Leave>", on_leave)
         
         # Adicionar seleção de cores
-        cores_frame = Frame(root)
+        cores_frame = tk.Frame(root)
         cores_frame.pack(pady=5, padx=10, fill=tk.X)
         tk.Label(cores_frame, text="Paleta de Cores:", font=("Arial", 10, "bold")).pack(side=tk.LEFT)
         
         for nome_paleta in self.paletas_cores.keys():
-            rb = Radiobutton(
+            rb = tk.Radiobutton(
                 cores_frame,
                 text=nome_paleta,
                 variable=self.paleta_selecionada,
@@ -481,16 +2759,16 @@ class App:
             rb.pack(side=tk.LEFT, padx=5)
         
         # Preview das cores
-        self.preview_frame = Frame(root)
+        self.preview_frame = tk.Frame(root)
         self.preview_frame.pack(pady=5, padx=10)
         self.atualizar_preview_cores()
     
-        tipo_lista_frame = Frame(root)
+        tipo_lista_frame = tk.Frame(root)
         tipo_lista_frame.pack(pady=5)
         tk.Label(tipo_lista_frame, text="Tipo de Lista:").pack(side=tk.LEFT)
-        Radiobutton(tipo_lista_frame, text="Lista de Alunos", variable=self.lista_tipo, 
+        tk.Radiobutton(tipo_lista_frame, text="Lista de Alunos", variable=self.lista_tipo, 
                    value="alunos", command=self.atualizar_modo_lista).pack(side=tk.LEFT)
-        Radiobutton(tipo_lista_frame, text="Lista de Funcionários", variable=self.lista_tipo,
+        tk.Radiobutton(tipo_lista_frame, text="Lista de Funcionários", variable=self.lista_tipo,
                    value="professores", command=self.atualizar_modo_lista).pack(side=tk.LEFT)
 
     def atualizar_modo_lista(self):
@@ -505,7 +2783,7 @@ class App:
             
         paleta = self.paletas_cores[self.paleta_selecionada.get()]
         for nome, cor in paleta.items():
-            preview = Frame(self.preview_frame, bg=cor, width=30, height=20)
+            preview = tk.Frame(self.preview_frame, bg=cor, width=30, height=20)
             preview.pack(side=tk.LEFT, padx=2)
             preview.pack_propagate(False)
             tk.Label(preview, text="", bg=cor).pack(expand=True)
@@ -521,34 +2799,25 @@ class App:
             self.etapas_listbox.delete(0, tk.END)
             self.escolas_listbox.delete(0, tk.END)
             
-            df = pd.read_csv(self.csv_path, sep=';', encoding='utf-8', dtype=str)
-            csv_format = detect_csv_format(df)
-            
-            # Normalize column names based on format
-            if csv_format == "professor_format":
-                df = df.rename(columns={
-                    'ETAPA': 'ETAPA DE ENSINO',
-                    'NOME DA ESCOLA': 'ESCOLA'
-                })
-            
-            coluna_etapa = 'ETAPA DE ENSINO'
-            coluna_escola = 'ESCOLA'
-            
-            if coluna_escola not in df.columns:
-                messagebox.showerror("Erro de CSV", 
-                    "O arquivo CSV precisa ter a coluna 'ESCOLA' ou 'NOME DA ESCOLA'.")
-                return
+            # Só tamanho e mtime: calcular o hash leria o arquivo inteiro antes de mostrar as listas
+            em_cache = CacheCsv().carregar(self.csv_path, calcular_hash=False) if self.usar_cache.get() else None
+            if em_cache is not None:
+                # A tabela normalizada do cache já traz as escolas e etapas como category
+                df = em_cache[1]
+                escolas_unicas = set(df['ESCOLA'].dropna().unique())
+                etapas_unicas = set(df['ETAPA DE ENSINO'].dropna().unique())
+            else:
+                # Varredura só das colunas de escola e etapa; o índice fica para a geração
+                indice = obter_indice_csv(self.csv_path)
+                escolas_unicas, etapas_unicas = indice.escolas, indice.etapas
                 
             # Popular lista de escolas
-            escolas_unicas = sorted(df[coluna_escola].dropna().unique())
-            for escola in escolas_unicas:
+            for escola in sorted(escolas_unicas):
                 self.escolas_listbox.insert(tk.END, escola)
             
-            # Popular lista de etapas se existirem
-            if coluna_etapa in df.columns:
-                etapas_unicas = sorted(df[coluna_etapa].dropna().unique())
-                for etapa in etapas_unicas:
-                    self.etapas_listbox.insert(tk.END, etapa)
+            # Popular lista de etapas
+            for etapa in sorted(etapas_unicas):
+                self.etapas_listbox.insert(tk.END, etapa)
             
         except Exception as e:
             messagebox.showerror("Erro ao Ler CSV", f"Não foi possível processar o arquivo CSV: {str(e)}")
@@ -566,12 +2835,13 @@ class App:
             self.output_label.config(text=self.output_dir)
     
     def gerar(self):
+        dispensa_modelo = self.apenas_lista_presenca.get() or self.formato_gabarito.get() == "pdf"
         if not all([self.csv_path, 
-                    (self.modelo_path or self.apenas_lista_presenca.get()), 
+                    (self.modelo_path or dispensa_modelo), 
                     self.output_dir]):
             messagebox.showerror("Erro", 
                 "Por favor, selecione o arquivo CSV, a pasta de saída " + 
-                ("e o modelo Word!" if not self.apenas_lista_presenca.get() else "!"))
+                ("e o modelo Word!" if not dispensa_modelo else "!"))
             return
         
         # Se nada estiver selecionado, usa todas as etapas e escolas
@@ -588,22 +2858,109 @@ class App:
                 titulo_lista=self.titulo_lista.get(),
                 data_lista=self.data_lista.get(),
                 cores=self.paletas_cores[self.paleta_selecionada.get()],
-                is_teacher_list=self.lista_tipo.get() == "professores"
+                is_teacher_list=self.lista_tipo.get() == "professores",
+                num_processos=self.num_processos.get(),
+                agrupamento_gabaritos=self.agrupamento_gabaritos.get(),
+                formato_gabarito=self.formato_gabarito.get(),
+                usar_cache=self.usar_cache.get(),
+                incremental=self.incremental.get(),
+                retomar=self.retomar.get(),
+                saida_zip=self.saida_zip.get()
             )
-            sucesso, mensagem = criar_gabaritos(self.csv_path, self.modelo_path, self.output_dir, 
-                                              config, etapas_selecionadas, escolas_selecionadas)
-            
-            if sucesso:
-                messagebox.showinfo("Sucesso", mensagem)
-            else:
-                messagebox.showerror("Erro", f"Falha ao gerar os documentos.\n\nDetalhes: {mensagem}")
+            self.iniciar_geracao(config, etapas_selecionadas, escolas_selecionadas)
         except Exception as e:
             messagebox.showerror("Erro Inesperado", f"Ocorreu um erro inesperado: {str(e)}")
 
+    def iniciar_geracao(self, config, etapas_selecionadas, escolas_selecionadas):
+        """Roda a geração numa thread para a janela continuar respondendo"""
+        self.cancelamento = threading.Event()
+        self.fila_eventos = queue.Queue()
+        instrumentacao = Instrumentacao([self.fila_eventos.put])
+        self.trabalho = threading.Thread(
+            target=self._gerar_em_segundo_plano,
+            args=(self.csv_path, self.modelo_path, self.output_dir, config, etapas_selecionadas,
+                  escolas_selecionadas, instrumentacao, self.cancelamento),
+            daemon=True)
+        self.botao_gerar.config(state=tk.DISABLED)
+        self.botao_cancelar.config(state=tk.NORMAL)
+        self.barra_progresso['value'] = 0
+        self.status_label.config(text="Lendo o CSV...")
+        self.trabalho.start()
+        self.root.after(100, self.acompanhar_geracao)
+
+    def _gerar_em_segundo_plano(self, *argumentos):
+        # Roda na thread: nada de Tk aqui, só a fila
+        try:
+            relatorio = executar_geracao(*argumentos)
+            self.fila_eventos.put({'tipo': 'resultado', 'relatorio': relatorio})
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.fila_eventos.put({'tipo': 'falha', 'mensagem': str(e)})
+
+    def acompanhar_geracao(self):
+        """Consome os eventos da thread de geração (reagendado com root.after até o fim)"""
+        while True:
+            try:
+                evento = self.fila_eventos.get_nowait()
+            except queue.Empty:
+                break
+            if evento['tipo'] == 'progresso':
+                self.barra_progresso['value'] = evento['percentual']
+                if not self.cancelamento.is_set():
+                    self.status_label.config(
+                        text=f"{evento['escola']}: {evento['documentos_escola']} documento(s) | "
+                             f"{evento['registros_processados']}/{evento['registros_total']} registros | "
+                             f"ETA {formatar_duracao(evento['eta_s'])}")
+            elif evento['tipo'] in ('resultado', 'falha'):
+                self.concluir_geracao(evento)
+                return
+        self.root.after(100, self.acompanhar_geracao)
+
+    def concluir_geracao(self, evento):
+        self.trabalho = None
+        if self.fechando:
+            self.root.destroy()
+            return
+        self.botao_gerar.config(state=tk.NORMAL)
+        self.botao_cancelar.config(state=tk.DISABLED)
+        if evento['tipo'] == 'falha':
+            self.status_label.config(text="Falha na geração")
+            messagebox.showerror("Erro", f"Falha ao gerar os documentos.\n\nDetalhes: {evento['mensagem']}")
+            return
+
+        relatorio = evento['relatorio']
+        self.status_label.config(text=relatorio.mensagem().splitlines()[0])
+        if relatorio.cancelado and not relatorio.erros:
+            messagebox.showwarning("Cancelado", relatorio.mensagem())
+        elif not relatorio.erros:
+            self.barra_progresso['value'] = 100
+            messagebox.showinfo("Sucesso", relatorio.mensagem())
+        else:
+            messagebox.showerror("Erro", f"Falha ao gerar os documentos.\n\nDetalhes: {relatorio.mensagem()}")
+
+    def cancelar(self):
+        """Pede a interrupção; a geração para depois do documento que estiver sendo gravado"""
+        if self.trabalho is not None:
+            self.cancelamento.set()
+            self.botao_cancelar.config(state=tk.DISABLED)
+            self.status_label.config(text="Cancelando após o documento atual...")
+
+    def fechar(self):
+        # Com geração em andamento, cancela e só fecha quando a thread terminar (sem arquivos pela metade)
+        if self.trabalho is not None:
+            self.fechando = True
+            self.cancelar()
+        else:
+            self.root.destroy()
+
 class Configuracao:
     def __init__(self, process_mode="dois_alunos", gerar_lista_presenca=True,
                  apenas_lista_presenca=False, titulo_lista="Lista de Presença",
-                 data_lista="", cores=None, is_teacher_list=False):
+                 data_lista="", cores=None, is_teacher_list=False, num_processos=1,
+                 nivel_compressao=6, agrupamento_gabaritos="arquivo", formato_gabarito="docx",
+                 layout_gabarito=None, usar_cache=False, diretorio_cache=None, incremental=False,
+                 retomar=False, saida_zip=False, limite_memoria_mb=None, gravadores=0, particao=None):
         self.process_mode = process_mode
         self.gerar_lista_presenca = gerar_lista_presenca
         self.apenas_lista_presenca = apenas_lista_presenca
@@ -616,8 +2973,183 @@ class Configuracao:
             "tabela_header": "#98FB98"
         }
         self.is_teacher_list = is_teacher_list
+        self.num_processos = max(1, int(num_processos))  # 1 = geração sequencial
+        self.nivel_compressao = nivel_compressao  # 0 (sem compressão) a 9 no document.xml dos gabaritos
+        self.agrupamento_gabaritos = agrupamento_gabaritos  # "arquivo", "turma" ou "escola"
+        self.formato_gabarito = formato_gabarito  # "docx" (modelo Word) ou "pdf" (desenho direto)
+        self.layout_gabarito = layout_gabarito  # Ajustes sobre LAYOUT_GABARITO_PADRAO no formato "pdf"
+        self.usar_cache = usar_cache  # Guarda o CSV normalizado em cache binário (CacheCsv)
+        self.diretorio_cache = diretorio_cache  # None = ~/.cache/gerador_gabaritos
+        self.incremental = incremental  # Só gera o que mudou desde a última execução (ManifestoSaida)
+        self.retomar = retomar  # Continua uma execução interrompida a partir do DiarioExecucao
+        self.saida_zip = saida_zip  # Grava cada escola direto em output_dir/ESCOLA.zip (SaidaZip)
+        self.limite_memoria_mb = limite_memoria_mb  # Teto de memória residente por processo; None = sem limite
+        self.gravadores = max(0, int(gravadores))  # Threads de gravação por processo; 0 = grava na hora
+        self.particao = ler_particao(particao)  # (k, N): gera só a k-ésima de N partições; None = tudo
 
-if __name__ == "__main__":
+def ler_particao(valor):
+    """Partição "k/N" (ou (k, N)) como tupla, com 1 <= k <= N; None fica None"""
+    if valor is None:
+        return None
+    try:
+        k, total = (int(parte) for parte in (valor.split('/') if isinstance(valor, str) else valor))
+    except (TypeError, ValueError):
+        raise ValueError(f"Partição inválida: {valor!r} (use k/N, por exemplo 2/4)")
+    if not 1 <= k <= total:
+        raise ValueError(f"Partição inválida: {valor!r} (k deve estar entre 1 e N)")
+    return (k, total)
+
+# Chaves de um job que não são parâmetros da Configuracao
+CHAVES_JOB = {'nome', 'csv', 'modelo', 'saida', 'escolas', 'etapas', 'paleta'}
+
+def ler_manifesto(caminho):
+    """Lê um manifesto de jobs em JSON ou YAML: uma lista de jobs ou {"padrao": {...}, "jobs": [...]}"""
+    with open(caminho, encoding='utf-8') as f:
+        if caminho.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Manifestos YAML precisam do pacote PyYAML (pip install pyyaml)")
+            conteudo = yaml.safe_load(f)
+        else:
+            conteudo = json.load(f)
+    if isinstance(conteudo, list):
+        return conteudo
+    padrao = conteudo.get('padrao', {})
+    return [{**padrao, **job} for job in conteudo['jobs']]
+
+def executar_job(job, instrumentacao=None):
+    """Executa um job do manifesto e devolve seu resumo (erros viram falha do job, não da execução)"""
+    inicio = time.perf_counter()
+    resumo = {'nome': job.get('nome'), 'csv': job.get('csv'), 'saida': job.get('saida')}
+    try:
+        parametros = {chave: valor for chave, valor in job.items() if chave not in CHAVES_JOB}
+        if job.get('paleta'):
+            if job['paleta'] not in PALETAS_CORES:
+                raise ValueError(f"Paleta desconhecida: {job['paleta']}")
+            parametros['cores'] = PALETAS_CORES[job['paleta']]
+        config = Configuracao(**parametros)
+        relatorio = executar_geracao(job['csv'], job.get('modelo'), job['saida'], config,
+                                     job.get('etapas'), job.get('escolas'), instrumentacao)
+        resumo.update(relatorio.como_dict(), sucesso=not relatorio.erros, mensagem=relatorio.mensagem())
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        resumo.update(sucesso=False, mensagem=str(e))
+    resumo['duracao_s'] = round(time.perf_counter() - inicio, 3)
+    return resumo
+
+def executar_jobs(jobs, coletores=(), perfil=None, arquivo_perfil=None):
+    """Roda os jobs em sequência no mesmo processo (modelos e estilos são reaproveitados)"""
+    inicio = time.perf_counter()
+    resumos = []
+    for i, job in enumerate(jobs):
+        arquivo = f"{arquivo_perfil}.{i}" if arquivo_perfil and len(jobs) > 1 else arquivo_perfil
+        instrumentacao = Instrumentacao(coletores, perfil, arquivo, job=job.get('nome'))
+        resumos.append(executar_job(job, instrumentacao))
+    return {
+        'sucesso': all(resumo['sucesso'] for resumo in resumos),
+        'duracao_s': round(time.perf_counter() - inicio, 3),
+        'jobs': resumos,
+    }
+
+def executar_cli(argv):
+    """Linha de comando sem interface gráfica; imprime o resumo em JSON no stdout"""
+    parser = argparse.ArgumentParser(prog="main.py", description="Gerador de Gabaritos e Listas de Presença")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    # Opções de acompanhamento, comuns aos dois subcomandos
+    acompanhamento = argparse.ArgumentParser(add_help=False)
+    acompanhamento.add_argument("--progresso", action="store_true",
+                                help="Barra de progresso no stderr (no lugar das mensagens por arquivo)")
+    acompanhamento.add_argument("--log-eventos", help="Grava os eventos de progresso em JSON lines")
+    acompanhamento.add_argument("--perfil", choices=["cprofile", "tracemalloc"],
+                                help="Captura um perfil do processo principal")
+    acompanhamento.add_argument("--arquivo-perfil", help="Onde salvar o perfil (.prof ou snapshot)")
+
+    lote = subcomandos.add_parser("lote", parents=[acompanhamento], help="Executa os jobs de um manifesto JSON/YAML")
+    lote.add_argument("manifesto")
+
+    gerar = subcomandos.add_parser("gerar", parents=[acompanhamento], help="Executa um único job")
+    gerar.add_argument("--csv", required=True)
+    gerar.add_argument("--modelo")
+    gerar.add_argument("--saida", required=True)
+    gerar.add_argument("--escola", action="append", dest="escolas", help="Pode ser repetido; padrão: todas")
+    gerar.add_argument("--etapa", action="append", dest="etapas", help="Pode ser repetido; padrão: todas")
+    gerar.add_argument("--paleta", choices=list(PALETAS_CORES))
+    gerar.add_argument("--modo", dest="process_mode", choices=["um_aluno", "dois_alunos"], default="dois_alunos")
+    gerar.add_argument("--titulo", dest="titulo_lista", default="Lista de Presença")
+    gerar.add_argument("--data", dest="data_lista", default="")
+    gerar.add_argument("--sem-lista", dest="gerar_lista_presenca", action="store_false")
+    gerar.add_argument("--apenas-lista", dest="apenas_lista_presenca", action="store_true")
+    gerar.add_argument("--funcionarios", dest="is_teacher_list", action="store_true")
+    gerar.add_argument("--processos", dest="num_processos", type=int, default=1)
+    gerar.add_argument("--compressao", dest="nivel_compressao", type=int, choices=range(10), default=6)
+    gerar.add_argument("--agrupamento", dest="agrupamento_gabaritos", choices=["arquivo", "turma", "escola"],
+                       default="arquivo")
+    gerar.add_argument("--formato", dest="formato_gabarito", choices=["docx", "pdf"], default="docx")
+    gerar.add_argument("--cache", dest="usar_cache", action="store_true")
+    gerar.add_argument("--diretorio-cache", dest="diretorio_cache")
+    gerar.add_argument("--incremental", action="store_true", help="Gera só os arquivos cujos dados mudaram")
+    gerar.add_argument("--retomar", action="store_true", help="Continua uma execução interrompida")
+    gerar.add_argument("--zip", dest="saida_zip", action="store_true",
+                       help="Grava os documentos de cada escola direto em ESCOLA.zip")
+    gerar.add_argument("--limite-memoria", dest="limite_memoria_mb", type=float, metavar="MB",
+                       help="Interrompe a geração se um processo passar desse uso de memória")
+    gerar.add_argument("--gravadores", type=int, default=0, metavar="N",
+                       help="Threads que gravam os arquivos enquanto os próximos são gerados (pasta na rede)")
+    gerar.add_argument("--particao", metavar="K/N",
+                       help="Gera só a partição K de N (uma por máquina); depois junte com o subcomando mesclar")
+
+    mesclar = subcomandos.add_parser("mesclar", help="Junta as saídas e os relatórios das partições")
+    mesclar.add_argument("--saida", required=True, help="Pasta final")
+    mesclar.add_argument("particoes", nargs="+", help="Pastas de saída (ou relatórios .json) das partições")
+
+    args = parser.parse_args(argv)
+    if args.comando == "mesclar":
+        try:
+            resumo = mesclar_particoes(args.particoes, args.saida)
+        except (OSError, ValueError, KeyError) as e:
+            resumo = {'saida': args.saida, 'sucesso': False, 'mensagem': str(e)}
+        print(json.dumps(resumo, ensure_ascii=False, indent=2))
+        return 0 if resumo['sucesso'] else 1
+    opcoes_acompanhamento = ("progresso", "log_eventos", "perfil", "arquivo_perfil")
+    if args.comando == "lote":
+        jobs = ler_manifesto(args.manifesto)
+    else:
+        job = {chave: valor for chave, valor in vars(args).items()
+               if chave != "comando" and chave not in opcoes_acompanhamento}
+        if job['is_teacher_list']:
+            # Mesmo ajuste da interface: lista de funcionários é sempre só lista de presença
+            job.update(process_mode="um_aluno", apenas_lista_presenca=True)
+        jobs = [job]
+
+    coletores = []
+    if args.progresso:
+        coletores.append(ColetorBarraProgresso(sys.stderr))
+    if args.log_eventos:
+        coletores.append(ColetorJsonl(args.log_eventos))
+
+    # As mensagens de progresso vão para o stderr (ou são omitidas com a barra); o stdout fica só com o resumo
+    try:
+        with open(os.devnull, 'w') as nulo, redirect_stdout(nulo if args.progresso else sys.stderr):
+            resumo = executar_jobs(jobs, coletores, args.perfil, args.arquivo_perfil)
+    finally:
+        for coletor in coletores:
+            if hasattr(coletor, 'fechar'):
+                coletor.fechar()
+    print(json.dumps(resumo, ensure_ascii=False, indent=2))
+    return 0 if resumo['sucesso'] else 1
+
+def main(argv=None):
+    """Sem argumentos abre a interface gráfica; com subcomandos roda pela linha de comando"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return executar_cli(argv)
     root = tk.Tk()
     app = App(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
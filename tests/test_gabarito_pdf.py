@@ -0,0 +1,40 @@
+"""
+Gabarito desenhado direto em PDF: com muitas questões as linhas da grade ficam mais juntas, e as
+bolhas têm de diminuir junto (ou o layout ser recusado) em vez de se sobreporem.
+"""
+import os
+import sys
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import main
+
+class TestGabaritoPDF(unittest.TestCase):
+    def assertSemSobreposicao(self, renderizador):
+        raio = renderizador.raio_bolha
+        _, y1 = renderizador._centro_bolha(0, 0)
+        _, y2 = renderizador._centro_bolha(1, 0)
+        x1, _ = renderizador._centro_bolha(0, 0)
+        x2, _ = renderizador._centro_bolha(0, 1)
+        self.assertGreater(y1 - y2, 2 * raio)
+        self.assertGreater(x2 - x1, 2 * raio)
+
+    def test_layout_padrao_mantem_o_raio(self):
+        for folhas in (1, 2):
+            renderizador = main.RenderizadorGabaritoPDF(folhas_por_pagina=folhas)
+            self.assertEqual(renderizador.raio_bolha, main.LAYOUT_GABARITO_PADRAO["raio_bolha"])
+            self.assertSemSobreposicao(renderizador)
+
+    def test_muitas_questoes_diminuem_as_bolhas(self):
+        renderizador = main.RenderizadorGabaritoPDF({"num_questoes": 60, "colunas": 3}, folhas_por_pagina=2)
+        self.assertLess(renderizador.raio_bolha, main.LAYOUT_GABARITO_PADRAO["raio_bolha"])
+        self.assertSemSobreposicao(renderizador)
+
+    def test_layout_que_nao_cabe_e_recusado(self):
+        with self.assertRaisesRegex(ValueError, "60 questões em 2 coluna"):
+            main.RenderizadorGabaritoPDF({"num_questoes": 60, "colunas": 2}, folhas_por_pagina=2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Regeneração incremental (.gabaritos_manifesto.json): execuções que geram tipos diferentes de
+arquivo na mesma pasta de saída não apagam os arquivos umas das outras.
+"""
+import os
+import io
+import sys
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import benchmark
+import main
+
+def arvore(pasta):
+    return sorted(os.path.relpath(os.path.join(diretorio, nome), pasta)
+                  for diretorio, _, nomes in os.walk(pasta) for nome in nomes
+                  if not nome.startswith('.gabaritos_'))
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.saida = os.path.join(self.pasta, "saida")
+        self.alunos = os.path.join(self.pasta, "alunos.csv")
+        self.funcionarios = os.path.join(self.pasta, "funcionarios.csv")
+        self.modelo = os.path.join(self.pasta, "modelo.docx")
+        benchmark.gerar_csv_sintetico(self.alunos, escolas=2, turmas=2, alunos=3)
+        benchmark.gerar_csv_sintetico(self.funcionarios, escolas=2, turmas=2, alunos=3, formato="professor_format")
+        benchmark.gerar_modelo_sintetico(self.modelo, paragrafos=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def gerar(self, csv_path, **opcoes):
+        with redirect_stdout(io.StringIO()):
+            relatorio = main.executar_geracao(csv_path, self.modelo, self.saida,
+                                              main.Configuracao(incremental=True, **opcoes), None, None)
+        self.assertFalse(relatorio.erros)
+        return relatorio
+
+    def test_alunos_e_funcionarios_na_mesma_pasta(self):
+        self.gerar(self.alunos)
+        arquivos_alunos = arvore(self.saida)
+
+        relatorio = self.gerar(self.funcionarios, is_teacher_list=True, apenas_lista_presenca=True,
+                               process_mode="um_aluno")
+        self.assertEqual(relatorio.removidos, 0)
+        listas_funcionarios = sorted(set(arvore(self.saida)) - set(arquivos_alunos))
+        self.assertEqual(len(listas_funcionarios), 2)
+
+        # Na ordem inversa, os alunos também não apagam as listas de funcionários
+        relatorio = self.gerar(self.alunos)
+        self.assertEqual(relatorio.removidos, 0)
+        self.assertEqual(relatorio.ignorados, len(arquivos_alunos))
+        self.assertEqual(arvore(self.saida), sorted(arquivos_alunos + listas_funcionarios))
+
+    def test_apenas_listas_mantem_gabaritos(self):
+        self.gerar(self.alunos)
+        completa = arvore(self.saida)
+
+        relatorio = self.gerar(self.alunos, apenas_lista_presenca=True)
+        self.assertEqual(relatorio.removidos, 0)
+        self.assertEqual(arvore(self.saida), completa)
+
+    def test_arquivos_desatualizados_do_mesmo_tipo_sao_removidos(self):
+        self.gerar(self.alunos)
+        # Sem a lista de presença, as listas continuam (outro tipo); os gabaritos sem aluno saem
+        with open(self.alunos, encoding='utf-8') as f:
+            linhas = f.readlines()
+        with open(self.alunos, 'w', encoding='utf-8') as f:
+            f.writelines(linhas[:-1])
+        relatorio = self.gerar(self.alunos, gerar_lista_presenca=False)
+        self.assertEqual(relatorio.removidos, 1)
+
+if __name__ == "__main__":
+    unittest.main()
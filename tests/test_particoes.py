@@ -0,0 +1,117 @@
+"""
+Execução dividida em partições: cada `gerar --particao k/N` roda num processo próprio, no lugar
+de uma máquina, e o `mesclar` tem de chegar ao mesmo resultado de uma execução única.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import benchmark
+
+MAIN = os.path.join(RAIZ, "main.py")
+CONTAGENS = ('registros', 'gabaritos', 'listas', 'ignorados', 'removidos', 'documentos', 'erros',
+             'sucesso', 'mensagem')
+
+def arvore(pasta):
+    """Arquivos gerados (sem os de controle), com o conteúdo"""
+    arquivos = {}
+    for diretorio, _, nomes in os.walk(pasta):
+        for nome in nomes:
+            if not nome.startswith('.gabaritos_'):
+                caminho = os.path.join(diretorio, nome)
+                with open(caminho, 'rb') as f:
+                    arquivos[os.path.relpath(caminho, pasta)] = len(f.read())
+    return arquivos
+
+class TestParticoes(unittest.TestCase):
+    PARTICOES = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pasta = tempfile.mkdtemp()
+        cls.csv = os.path.join(cls.pasta, "alunos.csv")
+        cls.modelo = os.path.join(cls.pasta, "modelo.docx")
+        benchmark.gerar_csv_sintetico(cls.csv, escolas=4, turmas=3, alunos=5)
+        benchmark.gerar_modelo_sintetico(cls.modelo, paragrafos=2)
+        cls.unico = cls.gerar(os.path.join(cls.pasta, "unico"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.pasta, ignore_errors=True)
+
+    @classmethod
+    def gerar(cls, saida, *extras):
+        processo = subprocess.run(
+            [sys.executable, MAIN, "gerar", "--csv", cls.csv, "--modelo", cls.modelo, "--saida", saida,
+             *extras], capture_output=True, text=True)
+        assert processo.returncode == 0, processo.stderr
+        return json.loads(processo.stdout)['jobs'][0]
+
+    def gerar_particoes(self, pastas):
+        # Um processo por partição, todos ao mesmo tempo, como máquinas diferentes
+        processos = [subprocess.Popen(
+            [sys.executable, MAIN, "gerar", "--csv", self.csv, "--modelo", self.modelo, "--saida", pasta,
+             "--particao", f"{k}/{self.PARTICOES}"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            for k, pasta in enumerate(pastas, 1)]
+        resumos = [json.loads(processo.communicate()[0])['jobs'][0] for processo in processos]
+        for processo in processos:
+            self.assertEqual(processo.returncode, 0)
+        return resumos
+
+    def mesclar(self, saida, pastas):
+        processo = subprocess.run([sys.executable, MAIN, "mesclar", "--saida", saida, *pastas],
+                                  capture_output=True, text=True)
+        return processo.returncode, json.loads(processo.stdout)
+
+    def test_mesclagem_igual_a_execucao_unica(self):
+        pastas = [os.path.join(self.pasta, f"particao_{k}") for k in range(1, self.PARTICOES + 1)]
+        resumos = self.gerar_particoes(pastas)
+        # Partições equilibradas: 12 turmas de 5 alunos em 3 partições
+        self.assertEqual([resumo['registros'] for resumo in resumos], [20, 20, 20])
+
+        final = os.path.join(self.pasta, "final")
+        codigo, resumo = self.mesclar(final, pastas)
+        self.assertEqual(codigo, 0)
+        for campo in CONTAGENS:
+            self.assertEqual(resumo[campo], self.unico[campo], campo)
+        self.assertEqual(sorted(resumo['etapas']), sorted(self.unico['etapas']))
+        self.assertEqual(arvore(final), arvore(os.path.join(self.pasta, "unico")))
+        self.assertEqual(len(resumo['particoes']), self.PARTICOES)
+
+    def test_pasta_da_particao_movida_antes_da_mesclagem(self):
+        pastas = [os.path.join(self.pasta, f"movida_{k}") for k in range(1, self.PARTICOES + 1)]
+        self.gerar_particoes(pastas)
+        # A pasta copiada de outra máquina não está mais no caminho gravado no relatório
+        copiada = pastas[0] + "_copiada"
+        os.rename(pastas[0], copiada)
+        pastas[0] = copiada
+
+        final = os.path.join(self.pasta, "final_movida")
+        codigo, resumo = self.mesclar(final, pastas)
+        self.assertEqual(codigo, 0)
+        self.assertEqual(resumo['documentos'], self.unico['documentos'])
+        self.assertEqual(arvore(final), arvore(os.path.join(self.pasta, "unico")))
+        self.assertEqual(arvore(copiada), {})
+
+    def test_arquivo_ausente_falha_sem_mover(self):
+        pastas = [os.path.join(self.pasta, f"ausente_{k}") for k in range(1, self.PARTICOES + 1)]
+        self.gerar_particoes(pastas)
+        perdido = sorted(arvore(pastas[1]))[0]
+        os.remove(os.path.join(pastas[1], perdido))
+
+        final = os.path.join(self.pasta, "final_ausente")
+        codigo, resumo = self.mesclar(final, pastas)
+        self.assertEqual(codigo, 1)
+        self.assertFalse(resumo['sucesso'])
+        self.assertIn(perdido, resumo['mensagem'])
+        self.assertFalse(os.path.exists(final))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Pastas de saída de escolas e turmas cujos nomes ficam iguais depois de sanitizados ("T/3" e "T_3"):
+cada uma tem a sua pasta, e a mesma em qualquer seleção de escolas/etapas.
+"""
+import os
+import io
+import sys
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import benchmark
+import main
+
+def arvore(pasta):
+    return sorted(os.path.relpath(os.path.join(diretorio, nome), pasta)
+                  for diretorio, _, nomes in os.walk(pasta) for nome in nomes
+                  if not nome.startswith('.gabaritos_'))
+
+class TestPastas(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.csv = os.path.join(self.pasta, "alunos.csv")
+        self.modelo = os.path.join(self.pasta, "modelo.docx")
+        with open(self.csv, 'w', encoding='utf-8') as f:
+            f.write("ESCOLA;TURMA;NOME DO ALUNO;PROFESSOR REGENTE;ETAPA DE ENSINO\n"
+                    "T/3;A/1;ANA;P;5º ANO\n"
+                    "T_3;A_1;BIA;P;5º ANO\n"
+                    "T_3;A/1;CAIO;P;6º ANO\n"
+                    "T/3;A_1;DANI;P;6º ANO\n")
+        benchmark.gerar_modelo_sintetico(self.modelo, paragrafos=1)
+        main._indices_csv.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+        main._indices_csv.clear()
+
+    def gerar(self, saida, escolas=None, etapas=None, **opcoes):
+        saida = os.path.join(self.pasta, saida)
+        with redirect_stdout(io.StringIO()):
+            relatorio = main.executar_geracao(self.csv, self.modelo, saida, main.Configuracao(**opcoes),
+                                              etapas, escolas)
+        self.assertFalse(relatorio.erros)
+        return arvore(saida)
+
+    def test_nomes_sem_alteracao_ficam_com_a_pasta(self):
+        self.assertEqual(self.gerar("completa"), [
+            'T_3/A_1/BIA_gabarito.docx', 'T_3/A_1/lista_presenca_A_1.pdf',
+            'T_3/A_1_2/CAIO_gabarito.docx', 'T_3/A_1_2/lista_presenca_A_1_2.pdf',
+            'T_3_2/A_1/DANI_gabarito.docx', 'T_3_2/A_1/lista_presenca_A_1.pdf',
+            'T_3_2/A_1_2/ANA_gabarito.docx', 'T_3_2/A_1_2/lista_presenca_A_1_2.pdf'])
+
+    def test_mesmas_pastas_em_qualquer_selecao(self):
+        completa = self.gerar("completa")
+        selecoes = [(["T/3"], None), (None, ["6º ANO"]), (["T/3"], ["5º ANO"])]
+        # Leitura em blocos, pelo índice da interface e pelo cache
+        for modo, opcoes in (("blocos", {}), ("indice", {}),
+                             ("cache", dict(usar_cache=True, diretorio_cache=os.path.join(self.pasta, "cache")))):
+            if modo == "indice":
+                main.obter_indice_csv(self.csv)
+            for numero, (escolas, etapas) in enumerate(selecoes):
+                with self.subTest(modo=modo, escolas=escolas, etapas=etapas):
+                    parcial = self.gerar(f"{modo}_{numero}", escolas, etapas, **opcoes)
+                    self.assertTrue(parcial)
+                    self.assertLessEqual(set(parcial), set(completa))
+
+if __name__ == "__main__":
+    unittest.main()
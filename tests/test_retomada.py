@@ -0,0 +1,81 @@
+"""
+Diário de progresso (.gabaritos_progresso.jsonl): uma execução interrompida por uma exceção
+(Ctrl-C, processo do pool que morreu) mantém o diário, e --retomar continua de onde ela parou.
+"""
+import os
+import io
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import redirect_stdout
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import benchmark
+import main
+
+def arvore(pasta):
+    return sorted(os.path.relpath(os.path.join(diretorio, nome), pasta)
+                  for diretorio, _, nomes in os.walk(pasta) for nome in nomes
+                  if not nome.startswith('.gabaritos_'))
+
+class TestRetomada(unittest.TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.csv = os.path.join(self.pasta, "alunos.csv")
+        self.modelo = os.path.join(self.pasta, "modelo.docx")
+        benchmark.gerar_csv_sintetico(self.csv, escolas=2, turmas=4, alunos=3)
+        benchmark.gerar_modelo_sintetico(self.modelo, paragrafos=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def gerar(self, saida, **opcoes):
+        with redirect_stdout(io.StringIO()) as mensagens:
+            relatorio = main.executar_geracao(self.csv, self.modelo, saida, main.Configuracao(**opcoes),
+                                              None, None)
+        return relatorio, mensagens.getvalue()
+
+    def interromper(self, saida, lote, **opcoes):
+        """Executa até o lote de número `lote` e simula um Ctrl-C nele"""
+        original = main.processar_lote_protegido
+        chamadas = []
+        def interromper_no_lote(proximo, contexto):
+            chamadas.append(proximo)
+            if len(chamadas) == lote:
+                raise KeyboardInterrupt
+            return original(proximo, contexto)
+
+        with mock.patch.object(main, 'processar_lote_protegido', interromper_no_lote):
+            with self.assertRaises(KeyboardInterrupt):
+                self.gerar(saida, **opcoes)
+
+    def test_interrupcao_mantem_diario_e_retomada_continua(self):
+        referencia, _ = self.gerar(os.path.join(self.pasta, "completa"))
+        saida = os.path.join(self.pasta, "interrompida")
+        diario = os.path.join(saida, main.DiarioExecucao.NOME_ARQUIVO)
+
+        self.interromper(saida, 4)
+        self.assertTrue(os.path.exists(diario))
+
+        relatorio, mensagens = self.gerar(saida, retomar=True)
+        self.assertIn("Retomando execução: 3 lote(s)", mensagens)
+        self.assertFalse(relatorio.erros)
+        self.assertEqual(relatorio.gabaritos + relatorio.listas + relatorio.ignorados,
+                         referencia.gabaritos + referencia.listas)
+        self.assertEqual(arvore(saida), arvore(os.path.join(self.pasta, "completa")))
+        self.assertFalse(os.path.exists(diario))  # Terminou completa: o diário é apagado
+
+    def test_retomada_com_outras_opcoes_de_lista_recomeca(self):
+        saida = os.path.join(self.pasta, "sem_listas")
+        self.interromper(saida, 4, gerar_lista_presenca=False)
+
+        relatorio, mensagens = self.gerar(saida, gerar_lista_presenca=True, retomar=True)
+        self.assertIn("Nenhum progresso compatível", mensagens)
+        self.assertEqual(relatorio.listas, 8)  # Uma por turma, inclusive as do progresso anterior
+
+if __name__ == "__main__":
+    unittest.main()